@@ -0,0 +1,121 @@
+import argparse
+import collections
+import os
+import tempfile
+import threading
+import time
+
+from bench_load import make_fake_bot
+
+CITIES = ["Moscow", "Saint Petersburg", "Kazan", "Novosibirsk", "Sochi"]
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingStorage:
+    def __init__(self, storage, after_chunks: int):
+        self.storage = storage
+        self.after_chunks = after_chunks
+
+    def iter_users(self, chunk_size: int, after=None):
+        for i, chunk in enumerate(self.storage.iter_users(chunk_size, after)):
+            if i == self.after_chunks:
+                raise Crash()
+            yield chunk
+
+
+def populate(users, n: int):
+    from models import UserState
+    from utils import check_and_reset_day
+
+    for i in range(n):
+        ud = UserState(
+            weight=60.0 + i % 40, height=160.0 + i % 40, age=20.0 + i % 50,
+            gender="male" if i % 2 else "female", activity=float(i % 90),
+            city=CITIES[i % len(CITIES)], water_goal=2000.0 + i % 500, calorie_goal=1800.0 + i % 700,
+        )
+        check_and_reset_day(ud)
+        ud.logged_water = float(i * 37 % 2500)
+        ud.logged_calories = float(i * 53 % 2600)
+        ud.burned_calories = float(i * 11 % 600)
+        users[10_000_000 + i] = ud
+        users.save(10_000_000 + i)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast the daily digest to synthetic users.")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--storage", choices=["memory", "sqlite"], default="sqlite")
+    parser.add_argument("--chunk", type=int, default=500)
+    parser.add_argument("--plot-workers", type=int, default=2)
+    parser.add_argument("--crash-after", type=int, default=3, help="chunks sent before a simulated crash")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-digest-")
+    os.environ.update({
+        "STORAGE_BACKEND": args.storage,
+        "STORAGE_PATH": os.path.join(workdir, "bot.db"),
+        "DIGEST_CHECKPOINT_PATH": os.path.join(workdir, "digest.json"),
+        "DIGEST_CHUNK_SIZE": str(args.chunk),
+        "PLOT_WORKERS": str(args.plot_workers),
+        "SEND_GLOBAL_RATE": "0",
+        "SEND_CHAT_RATE": "0",
+    })
+
+    import logging
+    logging.disable(logging.INFO)
+    from digest import DigestBroadcast
+    from jobs import digest
+    from plotting import renderer
+    from sender import outbox
+
+    populate(digest.storage, args.users)
+    digest.storage.flush()
+    renderer.warm()
+
+    sent = collections.Counter()
+    lock = threading.Lock()
+
+    def count_sends(method, data):
+        if method == "sendPhoto":
+            with lock:
+                sent[data["chat_id"]] += 1
+
+    fake_bot = make_fake_bot(4, on_post=count_sends)
+
+    def drain():
+        while outbox.depth() or sum(sent.values()) < digest_total():
+            time.sleep(0.01)
+
+    def digest_total():
+        return digest.load_checkpoint().get("sent", 0)
+
+    start = time.perf_counter()
+    crashing = DigestBroadcast(
+        CrashingStorage(digest.storage, args.crash_after), renderer, outbox, digest.text_fn,
+        digest.checkpoint_path, digest.chunk_size, digest.max_queued
+    )
+    try:
+        crashing.run(fake_bot)
+    except Crash:
+        pass
+    drain()
+    before = sum(sent.values())
+    digest.run(fake_bot)
+    drain()
+    elapsed = time.perf_counter() - start
+
+    duplicates = sum(1 for n in sent.values() if n > 1)
+    print(f"crash after {before} users, resumed and finished {sum(sent.values()) - before} more")
+    print(f"{len(sent)}/{args.users} users reached, {duplicates} duplicates")
+    print(f"{args.users} digests in {elapsed:.2f}s: {args.users / elapsed:.0f} users/sec "
+          f"({renderer.stats()['renders']} plots rendered, {args.plot_workers} workers)")
+    renderer.shutdown()
+    digest.storage.close()
+    assert len(sent) == args.users and not duplicates
+
+
+if __name__ == "__main__":
+    main()
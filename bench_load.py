@@ -0,0 +1,290 @@
+import argparse
+import glob
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+CITIES = ["Moscow", "Saint Petersburg", "Kazan", "Novosibirsk", "Sochi"]
+FOODS = ["яблоко", "хлеб", "сыр", "банан", "apple", "rice", "творог", "кефир"]
+WORKOUTS = ["бег", "ходьба", "плавание", "yoga", "cycling", "бокс"]
+MENU = ["MENU_PROFILE", "MENU_PROGRESS", "MENU_RECOMMEND"]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path.startswith("/weather"):
+            city = query.get("q", [""])[0]
+            body = {"cod": 200, "main": {"temp": 15 + len(city) % 20}, "timezone": 3600 * (len(city) % 12)}
+        else:
+            term = query.get("search_terms", [""])[0]
+            body = {"products": [{
+                "product_name": term.capitalize(),
+                "nutriments": {"energy-kcal_100g": 50 + len(term) * 17},
+            }]}
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server(latency: float) -> ThreadingHTTPServer:
+    handler = type("Stub", (StubHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_fake_bot(pool_size: int, on_post=None):
+    from telegram import Bot
+    from telegram.utils.request import Request
+
+    message_ids = itertools.count(1)
+
+    class FakeRequest(Request):
+        def post(self, url, data=None, timeout=None):
+            method = url.rsplit("/", 1)[1]
+            if on_post is not None:
+                on_post(method, data)
+            if method == "getMe":
+                return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+            if method == "answerCallbackQuery":
+                return True
+            chat_id = (data or {}).get("chat_id", 1)
+            return {
+                "message_id": next(message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": "",
+            }
+
+    return Bot("123456:bench-token-bench-token-bench-token", request=FakeRequest(con_pool_size=pool_size))
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        update_id = next(self._ids)
+        entities = []
+        if text.startswith("/"):
+            entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id),
+            "text": text, "entities": entities,
+        }}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        update_id = next(self._ids)
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": self._user(user_id), "chat_instance": str(user_id),
+            "data": data, "message": {
+                "message_id": update_id, "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"}, "text": "Выберите действие:",
+            },
+        }}
+
+
+def user_session(factory: UpdateFactory, user_id: int, actions: int, rng: random.Random) -> list:
+    steps = [
+        ("set_profile", factory.message(user_id, "/set_profile")),
+        ("ask_weight", factory.message(user_id, str(rng.randint(50, 110)))),
+        ("ask_height", factory.message(user_id, str(rng.randint(150, 200)))),
+        ("ask_age", factory.message(user_id, str(rng.randint(18, 70)))),
+        ("ask_gender", factory.message(user_id, rng.choice(["male", "female"]))),
+        ("ask_activity", factory.message(user_id, str(rng.choice([0, 30, 60, 90])))),
+        ("ask_city", factory.message(user_id, rng.choice(CITIES))),
+    ]
+    for _ in range(actions):
+        kind = rng.choices(
+            ["log_water", "log_food", "log_workout", "check_progress", "plot_progress", "menu"],
+            weights=[30, 25, 15, 15, 5, 10]
+        )[0]
+        if kind == "log_water":
+            steps.append((kind, factory.message(user_id, f"/log_water {rng.randint(100, 500)}")))
+        elif kind == "log_food":
+            steps.append((kind, factory.message(user_id, f"/log_food {rng.choice(FOODS)}")))
+            steps.append(("food_grams", factory.message(user_id, str(rng.randint(30, 300)))))
+        elif kind == "log_workout":
+            text = f"/log_workout {rng.choice(WORKOUTS)} {rng.randint(10, 90)}"
+            steps.append((kind, factory.message(user_id, text)))
+        elif kind == "menu":
+            steps.append(("menu_callback", factory.callback(user_id, rng.choice(MENU))))
+        else:
+            steps.append((kind, factory.message(user_id, f"/{kind}")))
+    return steps
+
+
+def interleave(sessions: list) -> list:
+    replay = []
+    for steps in itertools.zip_longest(*sessions):
+        replay.extend(s for s in steps if s is not None)
+    return replay
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(latencies: dict, waits: dict, total: int, elapsed: float) -> dict:
+    handlers = {}
+    for label, samples in sorted(latencies.items()):
+        handlers[label] = {
+            "count": len(samples),
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+            "mean_ms": statistics.fmean(samples) * 1000,
+            "queued_p95_ms": percentile(waits[label], 95) * 1000,
+        }
+    return {"updates": total, "seconds": elapsed, "updates_per_sec": total / elapsed, "handlers": handlers}
+
+
+def run(args) -> dict:
+    server = start_stub_server(args.latency)
+    base = f"http://127.0.0.1:{server.server_port}"
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.update({
+        "OPENWEATHER_URL": f"{base}/weather",
+        "FOOD_SEARCH_URL": f"{base}/search",
+        "FOOD_DB_PATH": os.path.join(workdir, "food.db"),
+        "STORAGE_BACKEND": args.storage,
+        "STORAGE_PATH": os.path.join(workdir, "bot.db"),
+        "PREWARM": "0",
+        "SEND_GLOBAL_RATE": "0",
+        "SEND_CHAT_RATE": "0",
+    })
+
+    import logging
+    logging.disable(logging.INFO)
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    import bot
+
+    fake_bot = make_fake_bot(args.workers + 4)
+    updater = bot.build_updater(bot=fake_bot, workers=args.workers)
+    dp = updater.dispatcher
+
+    rng = random.Random(args.seed)
+    factory = UpdateFactory()
+    sessions = [user_session(factory, 10_000 + i, args.actions, rng) for i in range(args.users)]
+    replay = [(label, Update.de_json(data, fake_bot)) for label, data in interleave(sessions)]
+
+    labels = {update.update_id: label for label, update in replay}
+    enqueued = {}
+    started = {}
+    latencies = {}
+    waits = {}
+    done = threading.Semaphore(0)
+
+    # Latency is service time, from the lane picking the update up to its last handler;
+    # time spent queued behind other updates is reported separately.
+    def begin(update, context):
+        started[update.update_id] = time.perf_counter()
+
+    def record(update, context):
+        now = time.perf_counter()
+        label = labels[update.update_id]
+        latencies.setdefault(label, []).append(now - started[update.update_id])
+        waits.setdefault(label, []).append(started[update.update_id] - enqueued[update.update_id])
+        done.release()
+
+    dp.add_handler(TypeHandler(Update, begin), group=-1_000_000)
+    dp.add_handler(TypeHandler(Update, record), group=1_000_000)
+    threading.Thread(target=dp.start, name="dispatcher", daemon=True).start()
+    while not dp.running:
+        time.sleep(0.01)
+
+    start = time.perf_counter()
+    for i, (_, update) in enumerate(replay):
+        if args.rate:
+            delay = start + i / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        enqueued[update.update_id] = time.perf_counter()
+        dp.update_queue.put(update)
+    for _ in replay:
+        done.acquire()
+    elapsed = time.perf_counter() - start
+
+    dp.stop()
+    bot.users.close()
+    bot.renderer.shutdown()
+    server.shutdown()
+
+    result = summarize(latencies, waits, len(replay), elapsed)
+    result["config"] = vars(args).copy()
+    return result
+
+
+def previous_result(out_dir: str, config: dict):
+    for path in sorted(glob.glob(os.path.join(out_dir, "load-*.json")), reverse=True):
+        with open(path, encoding="utf-8") as f:
+            result = json.load(f)
+        if result.get("config") == config:
+            return result
+    return None
+
+
+def report(result: dict, previous: dict = None):
+    print(f"{'handler':<16}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'Δp95':>10}{'queued p95':>12}")
+    for label, h in result["handlers"].items():
+        delta = ""
+        if previous and label in previous["handlers"]:
+            before = previous["handlers"][label]["p95_ms"]
+            if before:
+                delta = f"{(h['p95_ms'] - before) / before * 100:+.0f}%"
+        print(
+            f"{label:<16}{h['count']:>7}{h['p50_ms']:>10.2f}{h['p95_ms']:>10.2f}{h['p99_ms']:>10.2f}"
+            f"{delta:>10}{h.get('queued_p95_ms', 0.0):>12.2f}"
+        )
+    line = f"{result['updates']} updates in {result['seconds']:.2f}s: {result['updates_per_sec']:.0f} updates/sec"
+    if previous:
+        line += f" (previous run: {previous['updates_per_sec']:.0f})"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic traffic through the bot dispatcher.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--actions", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0, help="arrival rate, updates/sec (0 = burst)")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub upstream latency, seconds")
+    parser.add_argument("--storage", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="bench_results")
+    args = parser.parse_args()
+
+    result = run(args)
+    previous = previous_result(args.out, result["config"])
+    report(result, previous)
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, time.strftime("load-%Y%m%d-%H%M%S.json"))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import gc
+import tracemalloc
+
+from models import UserState
+
+CITIES = ["Moscow", "Saint Petersburg", "Kazan", "Novosibirsk", "Sochi"]
+
+
+def legacy_user(i: int) -> dict:
+    return {
+        "weight": 60.0 + i % 40, "height": 160.0 + i % 40, "age": 20.0 + i % 50,
+        "gender": "male" if i % 2 else "female", "activity": float(i % 90),
+        "city": CITIES[i % len(CITIES)], "current_date": "2024-01-01",
+        "logged_water": float(i % 2000), "logged_calories": float(i % 2500),
+        "burned_calories": float(i % 500), "water_goal": 2000.0 + i % 500,
+        "calorie_goal": 1800.0 + i % 700,
+    }
+
+
+def slotted_user(i: int) -> UserState:
+    return UserState(
+        weight=60.0 + i % 40, height=160.0 + i % 40, age=20.0 + i % 50,
+        gender="male" if i % 2 else "female", activity=float(i % 90),
+        city=CITIES[i % len(CITIES)], current_date=738886,
+        logged_water=float(i % 2000), logged_calories=float(i % 2500),
+        burned_calories=float(i % 500), water_goal=2000.0 + i % 500,
+        calorie_goal=1800.0 + i % 700,
+    )
+
+
+def measure(factory, n: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    users = {10_000_000 + i: factory(i) for i in range(n)}
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del users
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-user memory of the user state model.")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    legacy = measure(legacy_user, args.users)
+    slotted = measure(slotted_user, args.users)
+    for name, size in (("dict", legacy), ("UserState", slotted)):
+        print(f"{name:<10} {size / 2**20:8.1f} MiB total, {size / args.users:6.0f} B/user "
+              f"({args.users:,} users)")
+    print(f"saving: {(1 - slotted / legacy) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import os
+import random
+import time
+
+from bench_load import UpdateFactory, make_fake_bot, start_stub_server, user_session
+
+
+def fake_bot():
+    return make_fake_bot(8)
+
+
+def cpu_session(factory: UpdateFactory, user_id: int, actions: int, rng: random.Random) -> list:
+    steps = user_session(factory, user_id, 0, rng)
+    for _ in range(actions):
+        steps.append(("log_water", factory.message(user_id, f"/log_water {rng.randint(100, 900)}")))
+        steps.append(("plot_progress", factory.message(user_id, "/plot_progress")))
+    return steps
+
+
+def run(shards: int, replay: list, workers: int) -> float:
+    import multiprocessing
+    from sharding import ShardPool
+
+    done = multiprocessing.get_context("spawn").Queue()
+    pool = ShardPool(shards, fake_bot, workers, done_queue=done)
+    pool.start()
+
+    factory = UpdateFactory()
+    warmup = {}
+    user_id = 1
+    while len(warmup) < shards:
+        warmup.setdefault(pool.shard_of(user_id), user_id)
+        user_id += 1
+    for key in warmup.values():
+        pool.route(key, factory.message(key, "/start"))
+    for _ in warmup:
+        done.get()
+
+    start = time.perf_counter()
+    for key, data in replay:
+        pool.route(key, data)
+    for _ in replay:
+        done.get()
+    elapsed = time.perf_counter() - start
+    pool.stop()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure throughput scaling of the sharded worker mode.")
+    parser.add_argument("--shards", default="1,2,4")
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--actions", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    server = start_stub_server(0.0)
+    base = f"http://127.0.0.1:{server.server_port}"
+    os.environ.update({
+        "OPENWEATHER_URL": f"{base}/weather",
+        "FOOD_SEARCH_URL": f"{base}/search",
+        "PLOT_WORKERS": "0",
+        "PLOT_QUANTUM": "1",
+        "METRICS_PORT": "0",
+        "PREWARM": "0",
+        "SEND_GLOBAL_RATE": "0",
+        "SEND_CHAT_RATE": "0",
+        "LOG_LEVEL": "WARNING",
+    })
+
+    rng = random.Random(args.seed)
+    factory = UpdateFactory()
+    sessions = [cpu_session(factory, 10_000 + i, args.actions, rng) for i in range(args.users)]
+    replay = []
+    for steps in zip(*sessions):
+        for _, data in steps:
+            key = (data.get("message") or data["callback_query"])["from"]["id"]
+            replay.append((key, data))
+
+    print(f"{len(replay)} updates, {os.cpu_count()} CPUs")
+    baseline = None
+    for shards in (int(s) for s in args.shards.split(",")):
+        elapsed = run(shards, replay, args.workers)
+        rate = len(replay) / elapsed
+        baseline = baseline or rate
+        print(f"shards={shards:<3} {rate:8.1f} updates/sec  speedup x{rate / baseline:.2f} "
+              f"(efficiency {rate / baseline / shards * 100:.0f}%)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
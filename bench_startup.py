@@ -0,0 +1,43 @@
+import os
+import statistics
+import subprocess
+import sys
+
+BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET", "0.6"))
+RUNS = int(os.getenv("STARTUP_RUNS", "7"))
+LAZY_MODULES = ("matplotlib", "requests", "numpy")
+
+PROBE = f"""
+import sys, time
+start = time.perf_counter()
+from bot import main
+elapsed = time.perf_counter() - start
+loaded = [m for m in {LAZY_MODULES!r} if m in sys.modules]
+print(elapsed, ",".join(loaded))
+"""
+
+
+def measure() -> tuple:
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True
+    ).stdout.split()
+    return float(out[0]), out[1] if len(out) > 1 else ""
+
+
+def main():
+    samples = []
+    for _ in range(RUNS):
+        elapsed, loaded = measure()
+        assert not loaded, f"heavy modules imported at startup: {loaded}"
+        samples.append(elapsed)
+    median = statistics.median(samples)
+    print(f"import bot.main: median {median * 1000:.0f} ms, "
+          f"min {min(samples) * 1000:.0f} ms, max {max(samples) * 1000:.0f} ms "
+          f"(budget {BUDGET_SECONDS * 1000:.0f} ms, {RUNS} runs)")
+    assert median <= BUDGET_SECONDS, f"startup {median:.3f}s exceeds budget {BUDGET_SECONDS:.3f}s"
+
+
+if __name__ == "__main__":
+    main()
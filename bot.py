@@ -1,6 +1,9 @@
 import logging
-import sys
-from telegram import Update
+import random
+import threading
+from datetime import datetime
+from queue import Queue
+from telegram import Bot, Update
 from telegram.ext import (
     Updater,
     CommandHandler,
@@ -8,74 +11,161 @@ from telegram.ext import (
     Filters,
     ConversationHandler,
     CallbackQueryHandler,
-    CallbackContext
+    CallbackContext,
+    JobQueue
 )
+from telegram.utils.request import Request
 
-from config import TELEGRAM_BOT_TOKEN
+from config import (
+    TELEGRAM_BOT_TOKEN, PREWARM, BOT_MODE, UPDATE_WORKERS,
+    WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, METRICS_PORT, METRICS_ADDR, LOG_SAMPLE_RATE,
+    GOAL_RECOMPUTE_INTERVAL, SHARDS, DIGEST_TIME, STORAGE_BACKEND, DEFAULT_TZ_OFFSET
+)
+from log_pipeline import setup_logging, redact
+from jobs import recompute_goals_job, daily_digest_job, digest
+from metrics import instrument, registry, start_http_server
+from ordered_dispatcher import OrderedDispatcher
+from pending import pending, PENDING_FOOD_GRAMS, PENDING_WORKOUT_CONFIRM
+from plotting import renderer
 from handlers import (
     users,
     start_command, help_command,
     set_profile_command, ask_weight, ask_height, ask_age, ask_gender, ask_activity, ask_city, cancel,
-    log_water_command, log_food_command, handle_food_grams,
+    log_water_command, log_food_command, handle_food_grams, handle_workout_confirm,
     log_workout_command, check_progress_command,
-    plot_progress_command, recommend_command, profile_command,
+    plot_progress_command, report_command, recommend_command, profile_command, timezone_command,
     menu_command, menu_callback,
     STATE_ASK_WEIGHT, STATE_ASK_HEIGHT, STATE_ASK_AGE,
     STATE_ASK_GENDER, STATE_ASK_ACTIVITY, STATE_ASK_CITY
 )
+from utils import prewarm
 
-logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 logger = logging.getLogger(__name__)
 
 def log_all_messages(update: Update, context: CallbackContext):
+    if LOG_SAMPLE_RATE < 1.0 and random.random() >= LOG_SAMPLE_RATE:
+        return
     user = update.effective_user
     if update.message:
-        text = update.message.text
+        text = redact(update.message.text)
     else:
         text = "<no text>"
-    logger.info(
-        "User %s (username=%s) sent: %s",
-        user.id,
-        user.username,
-        text
-    )
+    logger.info("message", extra={"fields": {
+        "update_id": update.update_id,
+        "user_id": user.id if user else None,
+        "username": user.username if user else None,
+        "text": text,
+    }})
 
-def main():
-    updater = Updater(token=TELEGRAM_BOT_TOKEN, use_context=True)
-    dp = updater.dispatcher
+def build_updater(bot: Bot = None, workers: int = UPDATE_WORKERS) -> Updater:
+    if bot is None:
+        bot = Bot(token=TELEGRAM_BOT_TOKEN, request=Request(con_pool_size=workers + 4))
+    dp = OrderedDispatcher(bot, Queue(), workers=workers, job_queue=JobQueue())
+    dp.job_queue.set_dispatcher(dp)
+    updater = Updater(dispatcher=dp, workers=None)
+    setup_dispatcher(dp)
+    return updater
 
+def setup_dispatcher(dp):
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("set_profile", set_profile_command)],
+        entry_points=[CommandHandler("set_profile", instrument(set_profile_command))],
         states={
-            STATE_ASK_WEIGHT: [MessageHandler(Filters.text, ask_weight)],
-            STATE_ASK_HEIGHT: [MessageHandler(Filters.text, ask_height)],
-            STATE_ASK_AGE: [MessageHandler(Filters.text, ask_age)],
-            STATE_ASK_GENDER: [MessageHandler(Filters.text, ask_gender)],
-            STATE_ASK_ACTIVITY: [MessageHandler(Filters.text, ask_activity)],
-            STATE_ASK_CITY: [MessageHandler(Filters.text, ask_city)],
+            STATE_ASK_WEIGHT: [MessageHandler(Filters.text, instrument(ask_weight))],
+            STATE_ASK_HEIGHT: [MessageHandler(Filters.text, instrument(ask_height))],
+            STATE_ASK_AGE: [MessageHandler(Filters.text, instrument(ask_age))],
+            STATE_ASK_GENDER: [MessageHandler(Filters.text, instrument(ask_gender))],
+            STATE_ASK_ACTIVITY: [MessageHandler(Filters.text, instrument(ask_activity))],
+            STATE_ASK_CITY: [MessageHandler(Filters.text, instrument(ask_city))],
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", instrument(cancel))]
     )
 
-    dp.add_handler(CommandHandler("start", start_command))
-    dp.add_handler(CommandHandler("help", help_command))
+    dp.add_handler(CommandHandler("start", instrument(start_command)))
+    dp.add_handler(CommandHandler("help", instrument(help_command)))
     dp.add_handler(conv_handler)
-    dp.add_handler(CommandHandler("profile", profile_command))
-    dp.add_handler(CommandHandler("log_water", log_water_command))
-    dp.add_handler(CommandHandler("log_food", log_food_command))
-    dp.add_handler(CommandHandler("log_workout", log_workout_command))
-    dp.add_handler(CommandHandler("check_progress", check_progress_command))
-    dp.add_handler(CommandHandler("plot_progress", plot_progress_command))
-    dp.add_handler(CommandHandler("recommend", recommend_command))
-    dp.add_handler(CommandHandler("menu", menu_command))
-    dp.add_handler(CallbackQueryHandler(menu_callback, pattern="^MENU_"))
+    dp.add_handler(CommandHandler("profile", instrument(profile_command)))
+    dp.add_handler(CommandHandler("timezone", instrument(timezone_command)))
+    dp.add_handler(CommandHandler("log_water", instrument(log_water_command)))
+    dp.add_handler(CommandHandler("log_food", instrument(log_food_command)))
+    dp.add_handler(CommandHandler("log_workout", instrument(log_workout_command)))
+    dp.add_handler(CommandHandler("check_progress", instrument(check_progress_command)))
+    dp.add_handler(CommandHandler("plot_progress", instrument(plot_progress_command)))
+    dp.add_handler(CommandHandler("report", instrument(report_command)))
+    dp.add_handler(CommandHandler("recommend", instrument(recommend_command)))
+    dp.add_handler(CommandHandler("menu", instrument(menu_command)))
+    dp.add_handler(CallbackQueryHandler(instrument(menu_callback), pattern="^MENU_"))
 
     
-    dp.add_handler(MessageHandler(Filters.all, log_all_messages), group=0)
-    dp.add_handler(MessageHandler(Filters.text, handle_food_grams), group=1)
+    dp.add_handler(MessageHandler(Filters.all, instrument(log_all_messages)), group=0)
+    replies = Filters.text & ~Filters.command
+    dp.add_handler(MessageHandler(
+        replies & pending.filter(PENDING_FOOD_GRAMS), instrument(handle_food_grams)
+    ), group=1)
+    dp.add_handler(MessageHandler(
+        replies & pending.filter(PENDING_WORKOUT_CONFIRM), instrument(handle_workout_confirm)
+    ), group=1)
+
+def start_updater(updater: Updater):
+    if BOT_MODE == "webhook":
+        updater.start_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=TELEGRAM_BOT_TOKEN,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{TELEGRAM_BOT_TOKEN}"
+        )
+    else:
+        updater.start_polling()
 
-    updater.start_polling()
+def schedule_jobs(job_queue: JobQueue, shard=None):
+    if GOAL_RECOMPUTE_INTERVAL:
+        job_queue.run_repeating(
+            recompute_goals_job, interval=GOAL_RECOMPUTE_INTERVAL, first=GOAL_RECOMPUTE_INTERVAL,
+            context=shard
+        )
+    if DIGEST_TIME:
+        at = datetime.strptime(DIGEST_TIME, "%H:%M").time()
+        if DEFAULT_TZ_OFFSET is not None:
+            # APScheduler 3.6 only takes pytz zones; PTB depends on pytz.
+            import pytz
+            at = at.replace(tzinfo=pytz.FixedOffset(DEFAULT_TZ_OFFSET // 60))
+        job_queue.run_daily(daily_digest_job, time=at, context=shard)
+        if digest.pending(shard):
+            job_queue.run_once(daily_digest_job, when=0, context=shard)
+
+def run_sharded():
+    from sharding import build_ingress
+
+    updater = build_ingress(SHARDS)
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT, METRICS_ADDR)
+    start_updater(updater)
+    updater.idle()
+    updater.dispatcher.pool.stop()
+
+def main():
+    setup_logging()
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise SystemExit("BOT_MODE=webhook requires WEBHOOK_URL (the public https:// address of the bot)")
+    if SHARDS > 1:
+        if STORAGE_BACKEND != "sqlite":
+            # Shards are restarted on their own, and a restart would wipe an in-memory store.
+            raise SystemExit("SHARDS > 1 requires STORAGE_BACKEND=sqlite")
+        run_sharded()
+        return
+    updater = build_updater()
+    if METRICS_PORT:
+        registry.gauge(
+            "bot_pending_updates", "Updates queued on per-user lanes.",
+            fn=updater.dispatcher.pending
+        )
+        start_http_server(METRICS_PORT, METRICS_ADDR)
+    start_updater(updater)
+    schedule_jobs(updater.job_queue)
+    if PREWARM:
+        threading.Thread(target=prewarm, name="prewarm", daemon=True).start()
     updater.idle()
+    users.close()
+    renderer.shutdown()
 
 if __name__ == "__main__":
     main()
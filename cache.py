@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Call:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    def __init__(self, ttl=None, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._data),
+        }
+
+    def peek(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[0] is not None and entry[0] <= now):
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > now):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._inflight[key] = call
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                return self._stale_or_raise(key, call.error)
+            return call.value
+
+        try:
+            value = loader(key)
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.event.set()
+            return self._stale_or_raise(key, e)
+
+        self.put(key, value)
+        call.value = value
+        with self._lock:
+            self._inflight.pop(key, None)
+        call.event.set()
+        return value
+
+    def _stale_or_raise(self, key, error):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                raise error
+            self.stale_hits += 1
+            return entry[1]
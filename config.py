@@ -2,4 +2,68 @@ import os
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "")
+OPENWEATHER_URL = os.getenv("OPENWEATHER_URL", "http://api.openweathermap.org/data/2.5/weather")
 
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "900"))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "1024"))
+
+FOOD_SEARCH_URL = os.getenv("FOOD_SEARCH_URL", "https://world.openfoodfacts.org/cgi/search.pl")
+FOOD_DB_PATH = os.getenv("FOOD_DB_PATH", "food.db")
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "5"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.2"))
+# Budget for one call including retries; a retry that could overrun it is not started.
+HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", "10"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "memory")
+STORAGE_PATH = os.getenv("STORAGE_PATH", "bot.db")
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", "2"))
+# Unset means users without a timezone follow the server's local time (DST-aware).
+DEFAULT_TZ_OFFSET = int(os.environ["DEFAULT_TZ_OFFSET"]) if os.getenv("DEFAULT_TZ_OFFSET") else None
+
+PLOT_WORKERS = int(os.getenv("PLOT_WORKERS", "2"))
+PLOT_CACHE_SIZE = int(os.getenv("PLOT_CACHE_SIZE", "512"))
+PLOT_QUANTUM = float(os.getenv("PLOT_QUANTUM", "10"))
+REPORT_CACHE_TTL = float(os.getenv("REPORT_CACHE_TTL", "86400"))
+
+PREWARM = os.getenv("PREWARM", "1") == "1"
+
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_ADDR = os.getenv("METRICS_ADDR", "127.0.0.1")
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_REDACT = os.getenv("LOG_REDACT", "digits")
+LOG_TEXT_MAX = int(os.getenv("LOG_TEXT_MAX", "200"))
+
+GOAL_RECOMPUTE_INTERVAL = float(os.getenv("GOAL_RECOMPUTE_INTERVAL", "10800"))
+
+FOOD_LOOKUP_WORKERS = int(os.getenv("FOOD_LOOKUP_WORKERS", "8"))
+FOOD_LOOKUP_DEADLINE = float(os.getenv("FOOD_LOOKUP_DEADLINE", "4"))
+
+PENDING_INPUT_TTL = float(os.getenv("PENDING_INPUT_TTL", "600"))
+
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "4"))
+
+SHARDS = int(os.getenv("SHARDS", "1"))
+
+# HH:MM in DEFAULT_TZ_OFFSET when that is set, otherwise UTC (the job queue's clock).
+DIGEST_TIME = os.getenv("DIGEST_TIME", "21:00")
+DIGEST_CHUNK_SIZE = int(os.getenv("DIGEST_CHUNK_SIZE", "500"))
+DIGEST_MAX_QUEUED = int(os.getenv("DIGEST_MAX_QUEUED", "1000"))
+DIGEST_CHECKPOINT_PATH = os.getenv("DIGEST_CHECKPOINT_PATH", "digest.json")
@@ -0,0 +1,85 @@
+import threading
+import time
+from datetime import date
+
+from config import DEFAULT_TZ_OFFSET
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+SECONDS_PER_DAY = 86400
+MAX_SLEEP = 60.0
+
+
+class DayClock:
+    def __init__(self, default_offset: int = None):
+        self.default_offset = default_offset
+        # Day ordinal per UTC offset in seconds; None is the server default offset.
+        self._days = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def offset_at(self, ts: float, tz_offset: int = None) -> int:
+        if tz_offset is not None:
+            return tz_offset
+        if self.default_offset is not None:
+            return self.default_offset
+        # No fixed default: follow the server's local time, DST switches included.
+        return time.localtime(ts).tm_gmtoff
+
+    def day_at(self, ts: float, tz_offset: int = None) -> int:
+        return int((ts + self.offset_at(ts, tz_offset)) // SECONDS_PER_DAY) + EPOCH_ORDINAL
+
+    def today(self, tz_offset: int = None) -> int:
+        day = self._days.get(tz_offset)
+        if day is None:
+            day = self._add(tz_offset)
+        return day
+
+    def _add(self, tz_offset) -> int:
+        with self._lock:
+            days = dict(self._days)
+            day = days[tz_offset] = self.day_at(time.time(), tz_offset)
+            self._days = days
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="day-clock", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return day
+
+    def refresh(self, now: float = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._days = {offset: self.day_at(now, offset) for offset in self._days}
+
+    def _next_rollover(self, now: float) -> float:
+        rollovers = [
+            (self.day_at(now, offset) - EPOCH_ORDINAL + 1) * SECONDS_PER_DAY
+            - self.offset_at(now, offset)
+            for offset in self._days
+        ]
+        return min(rollovers, default=now + MAX_SLEEP)
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            now = time.time()
+            self.refresh(now)
+            # Capped so a wall-clock jump (NTP, suspend) is noticed within a minute.
+            self._wake.wait(min(max(self._next_rollover(now) - now, 0.0), MAX_SLEEP))
+
+
+clock = DayClock(DEFAULT_TZ_OFFSET)
+
+
+def today_key(tz_offset: int = None) -> int:
+    return clock.today(tz_offset)
+
+
+def day_key(ts: float, tz_offset: int = None) -> int:
+    return clock.day_at(ts, tz_offset)
+
+
+def format_offset(tz_offset: int) -> str:
+    sign = "-" if tz_offset < 0 else "+"
+    hours, minutes = divmod(abs(tz_offset) // 60, 60)
+    return f"UTC{sign}{hours:02d}:{minutes:02d}"
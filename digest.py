@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import time
+
+from metrics import registry
+from sender import PRIORITY_BULK
+from days import SECONDS_PER_DAY, today_key, day_key
+from models import UserState
+from storage import in_shard
+
+logger = logging.getLogger(__name__)
+
+digest_sent = registry.counter("bot_digest_sent_total", "Daily digests handed to the send queue.")
+
+
+class DigestBroadcast:
+    def __init__(self, storage, renderer, outbox, text_fn, checkpoint_path: str,
+                 chunk_size: int, max_queued: int):
+        self.storage = storage
+        self.renderer = renderer
+        self.outbox = outbox
+        self.text_fn = text_fn
+        self.checkpoint_path = checkpoint_path
+        self.chunk_size = chunk_size
+        self.max_queued = max_queued
+        self.rate = 0.0
+
+    def _path(self, shard) -> str:
+        return self.checkpoint_path if shard is None else f"{self.checkpoint_path}.{shard[0]}"
+
+    def load_checkpoint(self, shard=None) -> dict:
+        try:
+            with open(self._path(shard)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_checkpoint(self, shard, state: dict):
+        path = self._path(shard)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    def pending(self, shard=None, day: int = None) -> bool:
+        state = self.load_checkpoint(shard)
+        return state.get("day") == (today_key() if day is None else day) and not state.get("done")
+
+    def _day_view(self, user_id, ud: UserState, at: float) -> UserState:
+        # Each user gets the local day whose end is closest to the run: at 21:00 UTC
+        # that is still today in London but the day that has just ended in Moscow.
+        day = day_key(at - SECONDS_PER_DAY / 2, ud.tz_offset)
+        view = UserState.from_row(ud.values())
+        if ud.current_date > day:
+            _, view.logged_water, view.logged_calories, view.burned_calories = (
+                self.storage.daily_totals(user_id, 1, day)[0]
+            )
+        elif ud.current_date < day:
+            view.reset_counters(day)
+        view.current_date = day
+        return view
+
+    def _wait_for_room(self):
+        while self.outbox.depth() > self.max_queued:
+            time.sleep(0.1)
+
+    def run(self, bot, shard=None, day: int = None) -> dict:
+        day = today_key() if day is None else day
+        state = self.load_checkpoint(shard)
+        if state.get("day") == day:
+            if state.get("done"):
+                logger.info("Digest for day %d already sent, skipping", day)
+                return state
+            logger.info("Resuming digest for day %d after user %s", day, state["after"])
+        else:
+            state = {"day": day, "at": time.time(), "after": None, "sent": 0, "done": False}
+        at = state.get("at", time.time())
+
+        start = time.perf_counter()
+        sent = 0
+        for chunk in self.storage.iter_users(self.chunk_size, state["after"]):
+            last = chunk[-1][0]
+            # Users who stopped /set_profile half way have no goals to report on.
+            chunk = [(uid, ud) for uid, ud in chunk if ud.calorie_goal and in_shard(uid, shard)]
+            # Views, not the live state: the job thread must not reset anyone's counters.
+            chunk = [(uid, self._day_view(uid, ud, at)) for uid, ud in chunk]
+            pngs = self.renderer.render_progress_many([
+                (ud.logged_water, ud.water_goal, ud.logged_calories, ud.calorie_goal, ud.burned_calories)
+                for _, ud in chunk
+            ])
+            self._wait_for_room()
+            for (uid, ud), png in zip(chunk, pngs):
+                self.outbox.send_photo(bot, uid, png, priority=PRIORITY_BULK, caption=self.text_fn(ud))
+            digest_sent.inc(amount=len(chunk))
+            sent += len(chunk)
+            # The checkpoint moves once a chunk is queued, so a crash may drop up to
+            # max_queued digests but never sends anyone a second one.
+            state["sent"] += len(chunk)
+            state["after"] = last
+            self._save_checkpoint(shard, state)
+            self.rate = sent / (time.perf_counter() - start)
+            logger.info("Digest: %d users queued, %.0f users/s", state["sent"], self.rate)
+
+        state["done"] = True
+        self._save_checkpoint(shard, state)
+        elapsed = time.perf_counter() - start
+        self.rate = sent / elapsed if elapsed else 0.0
+        logger.info(
+            "Digest for day %d finished: %d users in %.1f s (%.0f users/s)",
+            day, state["sent"], elapsed, self.rate
+        )
+        return state
@@ -0,0 +1,229 @@
+import json
+import logging
+import re
+import sqlite3
+import sys
+import threading
+from array import array
+from bisect import bisect_left, insort
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^\w]+")
+MIN_SIMILARITY = 0.45
+MAX_CANDIDATES = 64
+
+
+def normalize(name: str) -> str:
+    name = name.lower().replace("ё", "е")
+    return _NON_WORD.sub(" ", name).strip()
+
+
+def trigrams(norm: str) -> set:
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FoodDB:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._names = []
+        self._norms = []
+        self._calories = array("f")
+        self._by_name = {}
+        self._sorted = []
+        self._trigrams = {}
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._names)
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                "norm TEXT PRIMARY KEY, name TEXT NOT NULL, calories REAL NOT NULL)"
+            )
+        return self._conn
+
+    def load(self):
+        self._ensure_loaded()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            rows = self._connect().execute("SELECT norm, name, calories FROM products").fetchall()
+            for norm, name, cals in rows:
+                self._sorted.append((norm, self._index(norm, name, cals)))
+            self._sorted.sort()
+            self._loaded = True
+            logger.info("Food DB loaded: %d products from %s", len(rows), self.path)
+
+    def _index(self, norm: str, name: str, calories: float) -> int:
+        idx = len(self._names)
+        self._names.append(name)
+        self._norms.append(norm)
+        self._calories.append(calories)
+        self._by_name[norm] = idx
+        for tg in trigrams(norm):
+            self._trigrams.setdefault(tg, array("I")).append(idx)
+        return idx
+
+    def _result(self, idx: int) -> dict:
+        return {"name": self._names[idx], "calories": round(float(self._calories[idx]), 1)}
+
+    def lookup(self, query: str):
+        self._ensure_loaded()
+        norm = normalize(query)
+        if not norm:
+            return None
+        idx = self._by_name.get(norm)
+        if idx is not None:
+            return self._result(idx)
+
+        pos = bisect_left(self._sorted, (norm,))
+        best = None
+        for key, idx in self._sorted[pos:pos + 16]:
+            if not key.startswith(norm):
+                break
+            if best is None or len(key) < len(best[0]):
+                best = (key, idx)
+        if best is not None:
+            return self._result(best[1])
+
+        return self._fuzzy(norm)
+
+    def _fuzzy(self, norm: str):
+        query_tgs = trigrams(norm)
+        postings = sorted(
+            (self._trigrams[tg] for tg in query_tgs if tg in self._trigrams),
+            key=len
+        )
+        if not postings:
+            return None
+        candidates = set()
+        for plist in postings:
+            candidates.update(plist[:MAX_CANDIDATES - len(candidates)])
+            if len(candidates) >= MAX_CANDIDATES:
+                break
+        best_idx, best_score = None, MIN_SIMILARITY
+        for idx in candidates:
+            tgs = trigrams(self._norms[idx])
+            score = len(query_tgs & tgs) / len(query_tgs | tgs)
+            if score > best_score:
+                best_idx, best_score = idx, score
+        return None if best_idx is None else self._result(best_idx)
+
+    def add(self, name: str, calories: float, aliases=()):
+        self._ensure_loaded()
+        rows = []
+        for n in (name, *aliases):
+            norm = normalize(n)
+            if norm:
+                rows.append((norm, name, float(calories)))
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO products (norm, name, calories) VALUES (?, ?, ?)", rows
+                )
+            for norm, n, cals in rows:
+                idx = self._by_name.get(norm)
+                if idx is None:
+                    insort(self._sorted, (norm, self._index(norm, n, cals)))
+                else:
+                    self._calories[idx] = cals
+
+    def import_rows(self, rows) -> int:
+        conn = self._connect()
+        count = 0
+        batch = []
+        with conn:
+            for name, cals in rows:
+                norm = normalize(name)
+                if not norm:
+                    continue
+                batch.append((norm, name.strip(), cals))
+                if len(batch) >= 10000:
+                    conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?)", batch)
+                    count += len(batch)
+                    batch = []
+            conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?)", batch)
+            count += len(batch)
+        self._loaded = False
+        self._names, self._norms, self._calories = [], [], array("f")
+        self._by_name, self._sorted, self._trigrams = {}, [], {}
+        return count
+
+
+NAME_FIELDS = ("product_name_ru", "product_name_en", "product_name")
+
+
+def _calories_of(value):
+    try:
+        cals = float(value)
+    except (TypeError, ValueError):
+        return None
+    return cals if 0 < cals < 1000 else None
+
+
+def _product_names(record: dict):
+    seen = set()
+    for field in NAME_FIELDS:
+        name = record.get(field)
+        if name and name not in seen:
+            seen.add(name)
+            yield name
+
+
+def read_csv_dump(path: str):
+    import csv
+
+    csv.field_size_limit(sys.maxsize)
+    with open(path, encoding="utf-8", newline="") as f:
+        sample = f.readline()
+        f.seek(0)
+        delimiter = "\t" if "\t" in sample else ","
+        for record in csv.DictReader(f, delimiter=delimiter):
+            cals = _calories_of(record.get("energy-kcal_100g"))
+            if cals is None:
+                continue
+            for name in _product_names(record):
+                yield name, cals
+
+
+def read_jsonl_dump(path: str):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            cals = _calories_of(record.get("nutriments", {}).get("energy-kcal_100g"))
+            if cals is None:
+                continue
+            for name in _product_names(record):
+                yield name, cals
+
+
+def main(argv):
+    if len(argv) != 3 or argv[0] != "import":
+        print("Usage: python food_db.py import <dump.csv|dump.jsonl> <food.db>")
+        return 1
+    _, dump, db_path = argv
+    reader = read_jsonl_dump if dump.endswith((".jsonl", ".json")) else read_csv_dump
+    count = FoodDB(db_path).import_rows(reader(dump))
+    print(f"Imported {count} product names into {db_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
@@ -1,42 +1,66 @@
+import io
 import logging
+import re
+import time
+from datetime import date
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext, ConversationHandler
 
 from utils import (
-    get_weather,
+    lookup_city,
     get_food_info,
+    get_food_infos,
+    parse_food_items,
     calculate_water_goal_advanced,
     calculate_calorie_goal_advanced,
     check_and_reset_day,
     generate_progress_plot
 )
 
+from days import clock, format_offset
+from models import UserState
+from pending import pending, PENDING_FOOD_GRAMS, PENDING_WORKOUT_CONFIRM
+from plotting import renderer
+from recommend import MET_VALUES, DEFAULT_MET, recommender
+from sender import outbox
+from storage import create_storage, EVENT_WATER, EVENT_FOOD, EVENT_WORKOUT
+
 logger = logging.getLogger(__name__)
-users = {}
+users = create_storage()
+
+TZ_PATTERN = re.compile(r"^(?:utc|gmt)?\s*([+-])?(\d{1,2})(?::?(\d{2}))?$")
+TZ_MIN_OFFSET, TZ_MAX_OFFSET = -12 * 3600, 14 * 3600
+TZ_USAGE = "Изменить: /timezone +3, /timezone -5:30 или /timezone auto (по городу)."
+YES_ANSWERS = ("да", "д", "yes", "y")
+NO_ANSWERS = ("нет", "н", "no", "n")
 
 STATE_ASK_WEIGHT, STATE_ASK_HEIGHT, STATE_ASK_AGE, STATE_ASK_GENDER, STATE_ASK_ACTIVITY, STATE_ASK_CITY = range(6)
 
 def start_command(update: Update, context: CallbackContext):
-    update.message.reply_text("Привет! Наберите /help, чтобы узнать, что я умею.")
+    outbox.reply_text(update.message, "Привет! Наберите /help, чтобы узнать, что я умею.")
 
 def help_command(update: Update, context: CallbackContext):
     text = (
         "/menu — Меню с кнопками.\n"
         "/set_profile — Настройка профиля.\n"
         "/log_water <мл> — Записать воду.\n"
-        "/log_food <продукт> — Записать продукт.\n"
+        "/log_food <продукт> [г], ... — Записать продукты.\n"
         "/log_workout <тип> <мин> — Записать тренировку.\n"
         "/check_progress — Прогресс.\n"
         "/plot_progress — Графики.\n"
+        "/report week|month — Отчёт за неделю или месяц.\n"
         "/recommend — Рекомендации.\n"
         "/profile — Текущий профиль.\n"
+        "/timezone [+3|auto] — Часовой пояс для смены дня.\n"
         "/cancel — Прервать настройку.\n"
     )
-    update.message.reply_text(text)
+    outbox.reply_text(update.message, text)
     menu_command(update, context)
 
 def set_profile_command(update: Update, context: CallbackContext):
-    update.message.reply_text("Введите вес (кг):")
+    # The profile answers are plain numbers too; a pending /log_food question would swallow them.
+    pending.cancel(update.effective_user.id)
+    outbox.reply_text(update.message, "Введите вес (кг):")
     return STATE_ASK_WEIGHT
 
 def ask_weight(update: Update, context: CallbackContext):
@@ -44,11 +68,12 @@ def ask_weight(update: Update, context: CallbackContext):
     try:
         w = float(update.message.text.strip())
     except:
-        update.message.reply_text("Нужно число. Повторите ввод веса (кг):")
+        outbox.reply_text(update.message, "Нужно число. Повторите ввод веса (кг):")
         return STATE_ASK_WEIGHT
-    users[user_id] = users.get(user_id, {})
-    users[user_id]["weight"] = w
-    update.message.reply_text("Введите рост (см):")
+    if user_id not in users:
+        users[user_id] = UserState()
+    users[user_id].weight = w
+    outbox.reply_text(update.message, "Введите рост (см):")
     return STATE_ASK_HEIGHT
 
 def ask_height(update: Update, context: CallbackContext):
@@ -56,10 +81,10 @@ def ask_height(update: Update, context: CallbackContext):
     try:
         h = float(update.message.text.strip())
     except:
-        update.message.reply_text("Нужно число. Повторите ввод роста (см):")
+        outbox.reply_text(update.message, "Нужно число. Повторите ввод роста (см):")
         return STATE_ASK_HEIGHT
-    users[user_id]["height"] = h
-    update.message.reply_text("Введите возраст (лет):")
+    users[user_id].height = h
+    outbox.reply_text(update.message, "Введите возраст (лет):")
     return STATE_ASK_AGE
 
 def ask_age(update: Update, context: CallbackContext):
@@ -67,20 +92,20 @@ def ask_age(update: Update, context: CallbackContext):
     try:
         a = float(update.message.text.strip())
     except:
-        update.message.reply_text("Нужно число. Повторите ввод возраста (лет):")
+        outbox.reply_text(update.message, "Нужно число. Повторите ввод возраста (лет):")
         return STATE_ASK_AGE
-    users[user_id]["age"] = a
-    update.message.reply_text("Укажите пол (male/female):")
+    users[user_id].age = a
+    outbox.reply_text(update.message, "Укажите пол (male/female):")
     return STATE_ASK_GENDER
 
 def ask_gender(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     g = update.message.text.strip().lower()
     if g not in ["male","female"]:
-        update.message.reply_text("Введите 'male' или 'female'.")
+        outbox.reply_text(update.message, "Введите 'male' или 'female'.")
         return STATE_ASK_GENDER
-    users[user_id]["gender"] = g
-    update.message.reply_text("Сколько минут активности в день?")
+    users[user_id].gender = g
+    outbox.reply_text(update.message, "Сколько минут активности в день?")
     return STATE_ASK_ACTIVITY
 
 def ask_activity(update: Update, context: CallbackContext):
@@ -88,213 +113,358 @@ def ask_activity(update: Update, context: CallbackContext):
     try:
         act = float(update.message.text.strip())
     except:
-        update.message.reply_text("Нужно число. Повторите ввод активности (мин):")
+        outbox.reply_text(update.message, "Нужно число. Повторите ввод активности (мин):")
         return STATE_ASK_ACTIVITY
-    users[user_id]["activity"] = act
-    update.message.reply_text("В каком городе вы находитесь?")
+    users[user_id].activity = act
+    outbox.reply_text(update.message, "В каком городе вы находитесь?")
     return STATE_ASK_CITY
 
 def ask_city(update: Update, context: CallbackContext):
-    from datetime import datetime
     user_id = update.effective_user.id
     c = update.message.text.strip()
-    users[user_id]["city"] = c
-    users[user_id]["current_date"] = datetime.now().strftime("%Y-%m-%d")
-    users[user_id]["logged_water"] = 0
-    users[user_id]["logged_calories"] = 0
-    users[user_id]["burned_calories"] = 0
-    t = get_weather(c)
-    w_kg = users[user_id]["weight"]
-    a_min = users[user_id]["activity"]
-    h_cm = users[user_id]["height"]
-    a = users[user_id]["age"]
-    g = users[user_id]["gender"]
+    weather = lookup_city(c)
+    t, tz = (0.0, None) if weather is None else weather
+    users[user_id].city = c
+    users[user_id].tz_offset = tz
+    users[user_id].tz_manual = False
+    users[user_id].reset_counters(clock.today(tz))
+    w_kg = users[user_id].weight
+    a_min = users[user_id].activity
+    h_cm = users[user_id].height
+    a = users[user_id].age
+    g = users[user_id].gender
     wg = calculate_water_goal_advanced(w_kg, a_min, t)
     cg = calculate_calorie_goal_advanced(w_kg, h_cm, a, a_min, g)
-    users[user_id]["water_goal"] = wg
-    users[user_id]["calorie_goal"] = cg
-    update.message.reply_text(
+    users[user_id].water_goal = wg
+    users[user_id].calorie_goal = cg
+    users.save(user_id)
+    text = (
         f"Профиль сохранён!\n"
         f"Вес: {w_kg} кг, Рост: {h_cm} см, Возраст: {a}, Пол: {g}\n"
         f"Активность: {a_min} мин/день\n"
         f"Город: {c}, Температура: ~{t} °C\n"
         f"Вода: ~{int(wg)} мл, Калории: ~{int(cg)} ккал"
     )
+    outbox.reply_text(update.message, text)
     return ConversationHandler.END
 
 def cancel(update: Update, context: CallbackContext):
-    update.message.reply_text("Операция отменена.")
+    outbox.reply_text(update.message, "Операция отменена.")
     return ConversationHandler.END
 
 def log_water_command(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     if user_id not in users:
-        update.message.reply_text("Сначала /set_profile.")
+        outbox.reply_text(update.message, "Сначала /set_profile.")
         return
     check_and_reset_day(users[user_id])
     args = context.args
     if not args:
-        update.message.reply_text("Использование: /log_water <мл>")
+        outbox.reply_text(update.message, "Использование: /log_water <мл>")
         return
     try:
         amt = float(args[0])
     except:
-        update.message.reply_text("Нужно число (мл).")
+        outbox.reply_text(update.message, "Нужно число (мл).")
         return
-    users[user_id]["logged_water"] += amt
-    wg = users[user_id]["water_goal"]
-    cur = users[user_id]["logged_water"]
+    users[user_id].logged_water += amt
+    users.touch(user_id)
+    users.log_event(user_id, EVENT_WATER, amt)
+    wg = users[user_id].water_goal
+    cur = users[user_id].logged_water
     left = max(wg - cur, 0)
-    update.message.reply_text(f"Добавлено: {amt} мл. Всего: {cur:.1f}/{wg:.1f}. Осталось: {left:.1f} мл.")
+    outbox.reply_text(update.message, f"Добавлено: {amt} мл. Всего: {cur:.1f}/{wg:.1f}. Осталось: {left:.1f} мл.")
 
 def log_food_command(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     if user_id not in users:
-        update.message.reply_text("Сначала /set_profile.")
+        outbox.reply_text(update.message, "Сначала /set_profile.")
         return
     check_and_reset_day(users[user_id])
-    product_name = " ".join(context.args).strip()
-    if not product_name:
-        update.message.reply_text("Использование: /log_food <продукт>")
+    items = parse_food_items(" ".join(context.args))
+    if not items:
+        outbox.reply_text(update.message, "Использование: /log_food <продукт> или /log_food <продукт> <г>, <продукт> <г>, ...")
+        return
+    # A new /log_food supersedes an unanswered "how many grams" question.
+    pending.cancel(user_id)
+    if len(items) > 1 or items[0][1] is not None:
+        log_food_items(update, user_id, items)
         return
+    product_name = items[0][0]
     info = get_food_info(product_name)
     if not info:
-        update.message.reply_text("Не найдена калорийность.")
+        outbox.reply_text(update.message, "Не найдена калорийность.")
         return
-    context.user_data["food_info"] = info
-    context.user_data["waiting_for_grams"] = True
-    update.message.reply_text(
-        f"Найдено: {info['name']}, {info['calories']} ккал/100г. Сколько грамм съели?"
+    pending.expect(user_id, PENDING_FOOD_GRAMS, info)
+    outbox.reply_text(update.message, f"Найдено: {info['name']}, {info['calories']} ккал/100г. Сколько грамм съели?")
+
+def log_food_items(update: Update, user_id: int, items: list):
+    missing_grams = [name for name, grams in items if grams is None]
+    if missing_grams:
+        text = f"Укажите граммы для: {', '.join(missing_grams)}.\nПример: /log_food яблоко 150, хлеб 50"
+        outbox.reply_text(update.message, text)
+        return
+    infos = get_food_infos([name for name, _ in items])
+    lines = []
+    not_found = []
+    total = 0.0
+    for name, grams in items:
+        info = infos.get(name)
+        if not info:
+            not_found.append(name)
+            continue
+        cals = (info["calories"] / 100.0) * grams
+        total += cals
+        users.log_event(user_id, EVENT_FOOD, cals)
+        lines.append(f"• {info['name']}: {grams:g} г — {round(cals,1)} ккал")
+    if lines:
+        users[user_id].logged_calories += total
+        users.touch(user_id)
+    text = "Записано:\n" + "\n".join(lines) if lines else "Ничего не записано."
+    if not_found:
+        text += f"\nНе найдена калорийность: {', '.join(not_found)}."
+    text += (
+        f"\nИтого: {round(total,1)} ккал. "
+        f"Всего за день: {round(users[user_id].logged_calories,1)} ккал."
     )
+    outbox.reply_text(update.message, text)
 
 def handle_food_grams(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     if user_id not in users:
+        pending.cancel(user_id)
         return
-    if context.user_data.get("waiting_for_grams"):
-        check_and_reset_day(users[user_id])
-        try:
-            grams = float(update.message.text.strip())
-        except:
-            update.message.reply_text("Введите число (граммы).")
-            return
-        info = context.user_data.get("food_info")
-        if not info:
-            update.message.reply_text("Ошибка, /log_food снова.")
-            context.user_data["waiting_for_grams"] = False
-            return
-        total_cals = (info["calories"] / 100.0) * grams
-        users[user_id]["logged_calories"] += total_cals
-        update.message.reply_text(
-            f"Записано: {round(total_cals,1)} ккал.\n"
-            f"Всего: {round(users[user_id]['logged_calories'],1)} ккал."
-        )
-        context.user_data["waiting_for_grams"] = False
-        context.user_data["food_info"] = None
-
-MET_VALUES = {
-    "бег":9.8, "running":9.8, "ходьба":3.5, "walking":3.5,
-    "плавание":7.0, "swimming":7.0, "велосипед":6.0, "cycling":6.0,
-    "йога":3.0, "yoga":3.0
-}
+    check_and_reset_day(users[user_id])
+    try:
+        grams = float(update.message.text.strip())
+    except:
+        outbox.reply_text(update.message, "Введите число (граммы).")
+        return
+    info = pending.pop(user_id, PENDING_FOOD_GRAMS)
+    if not info:
+        outbox.reply_text(update.message, "Ошибка, /log_food снова.")
+        return
+    total_cals = (info["calories"] / 100.0) * grams
+    users[user_id].logged_calories += total_cals
+    users.touch(user_id)
+    users.log_event(user_id, EVENT_FOOD, total_cals)
+    text = f"Записано: {round(total_cals,1)} ккал.\nВсего: {round(users[user_id].logged_calories,1)} ккал."
+    outbox.reply_text(update.message, text)
 
 def log_workout_command(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     if user_id not in users:
-        update.message.reply_text("Сначала /set_profile.")
+        outbox.reply_text(update.message, "Сначала /set_profile.")
         return
     check_and_reset_day(users[user_id])
     args = context.args
     if len(args) < 2:
-        update.message.reply_text("Использование: /log_workout <тип> <мин>")
+        outbox.reply_text(update.message, "Использование: /log_workout <тип> <мин>")
         return
     wtype = args[0].lower()
     try:
         minutes = float(args[1])
     except:
-        update.message.reply_text("Минуты должны быть числом.")
+        outbox.reply_text(update.message, "Минуты должны быть числом.")
+        return
+    met = MET_VALUES.get(wtype)
+    if met is None:
+        pending.expect(user_id, PENDING_WORKOUT_CONFIRM, (wtype, minutes))
+        text = (
+            f"Тип «{wtype}» неизвестен. Записать как тренировку средней интенсивности "
+            f"(MET {DEFAULT_MET})? Ответьте «да» или «нет»."
+        )
+        outbox.reply_text(update.message, text)
+        return
+    record_workout(update, user_id, wtype, minutes, met)
+
+def handle_workout_confirm(update: Update, context: CallbackContext):
+    user_id = update.effective_user.id
+    if user_id not in users:
+        pending.cancel(user_id)
+        return
+    answer = update.message.text.strip().lower()
+    if answer not in YES_ANSWERS + NO_ANSWERS:
+        outbox.reply_text(update.message, "Ответьте «да» или «нет».")
         return
-    met = MET_VALUES.get(wtype, 5.0)
-    weight_kg = users[user_id]["weight"]
+    workout = pending.pop(user_id, PENDING_WORKOUT_CONFIRM)
+    if workout is None:
+        outbox.reply_text(update.message, "Ошибка, /log_workout снова.")
+        return
+    if answer in NO_ANSWERS:
+        outbox.reply_text(update.message, "Тренировка не записана.")
+        return
+    check_and_reset_day(users[user_id])
+    wtype, minutes = workout
+    record_workout(update, user_id, wtype, minutes, DEFAULT_MET)
+
+def record_workout(update: Update, user_id: int, wtype: str, minutes: float, met: float):
+    weight_kg = users[user_id].weight
     cals_burned = met * weight_kg * (minutes / 60)
-    users[user_id]["burned_calories"] += cals_burned
+    users[user_id].burned_calories += cals_burned
+    users.touch(user_id)
+    users.log_event(user_id, EVENT_WORKOUT, cals_burned)
     add_water = (minutes // 30)*200
     msg = f"{wtype.capitalize()} {minutes} мин. Сожжено ~{int(cals_burned)} ккал."
     if add_water > 0:
         msg += f" Дополнительно выпейте ~{int(add_water)} мл воды."
-    update.message.reply_text(msg)
+    outbox.reply_text(update.message, msg)
 
-def check_progress_command(update: Update, context: CallbackContext):
-    user_id = update.effective_user.id
-    if user_id not in users:
-        update.message.reply_text("Сначала /set_profile.")
-        return
-    check_and_reset_day(users[user_id])
-    ud = users[user_id]
-    w_goal = ud["water_goal"]
-    w_logged = ud["logged_water"]
-    c_goal = ud["calorie_goal"]
-    c_logged = ud["logged_calories"]
-    c_burned = ud["burned_calories"]
+def progress_text(ud: UserState) -> str:
+    w_goal = ud.water_goal
+    w_logged = ud.logged_water
+    c_goal = ud.calorie_goal
+    c_logged = ud.logged_calories
+    c_burned = ud.burned_calories
     left = max(w_goal - w_logged, 0)
     bal = c_goal - c_logged + c_burned
-    text = (
+    return (
         f"Вода: {w_logged:.1f}/{w_goal:.1f} мл, осталось {left:.1f}\n"
         f"Калории: съедено {round(c_logged,1)}/{round(c_goal,1)}, "
         f"сожжено {round(c_burned,1)}, баланс {round(bal,1)}"
     )
-    update.message.reply_text(text)
+
+def check_progress_command(update: Update, context: CallbackContext):
+    user_id = update.effective_user.id
+    if user_id not in users:
+        outbox.reply_text(update.message, "Сначала /set_profile.")
+        return
+    check_and_reset_day(users[user_id])
+    outbox.reply_text(update.message, progress_text(users[user_id]))
 
 def plot_progress_command(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     if user_id not in users:
-        update.message.reply_text("Сначала /set_profile.")
+        outbox.reply_text(update.message, "Сначала /set_profile.")
         return
     check_and_reset_day(users[user_id])
     ud = users[user_id]
     buf = generate_progress_plot(
-        w_logged=ud["logged_water"],
-        w_goal=ud["water_goal"],
-        c_logged=ud["logged_calories"],
-        c_goal=ud["calorie_goal"],
-        c_burned=ud["burned_calories"]
+        w_logged=ud.logged_water,
+        w_goal=ud.water_goal,
+        c_logged=ud.logged_calories,
+        c_goal=ud.calorie_goal,
+        c_burned=ud.burned_calories
+    )
+    outbox.reply_photo(update.message, photo=buf, caption="Графики воды и калорий.")
+
+REPORT_PERIODS = {"week": 7, "неделя": 7, "month": 30, "месяц": 30}
+
+def _trend(values: list) -> str:
+    if len(values) < 2:
+        return ""
+    half = len(values) // 2
+    before = sum(values[:half]) / half
+    after = sum(values[half:]) / (len(values) - half)
+    if abs(after - before) < max(before, after, 1) * 0.05:
+        return "→"
+    return "↑" if after > before else "↓"
+
+def report_command(update: Update, context: CallbackContext):
+    user_id = update.effective_user.id
+    if user_id not in users:
+        outbox.reply_text(update.message, "Сначала /set_profile.")
+        return
+    check_and_reset_day(users[user_id])
+    period = (context.args[0].lower() if context.args else "week")
+    days = REPORT_PERIODS.get(period)
+    if not days:
+        outbox.reply_text(update.message, "Использование: /report week|month")
+        return
+    ud = users[user_id]
+    rows = users.daily_totals(user_id, days + 1)
+    recent = rows[1:]
+    water = [r[1] for r in recent]
+    eaten = [r[2] for r in recent]
+    burned = [r[3] for r in recent]
+    balance = [ud.calorie_goal - e + b for e, b in zip(eaten, burned) if e]
+    text = (
+        f"Отчёт за {days} дн.\n"
+        f"Вода: всего {sum(water):.0f} мл, в среднем {sum(water)/days:.0f}/{ud.water_goal:.0f} мл в день {_trend(water)}\n"
+        f"Съедено: {sum(eaten):.0f} ккал, в среднем {sum(eaten)/days:.0f} ккал в день {_trend(eaten)}\n"
+        f"Сожжено: {sum(burned):.0f} ккал, в среднем {sum(burned)/days:.0f} ккал в день {_trend(burned)}\n"
+        f"Баланс: в среднем {sum(balance)/max(len(balance), 1):.0f} ккал в день {_trend(balance)}"
+    )
+    outbox.reply_text(update.message, text)
+
+    chart_rows = rows[:-1]
+    key = (user_id, days, chart_rows[-1][0])
+    png = renderer.render_report(
+        key,
+        [date.fromordinal(r[0]).strftime("%d.%m") for r in chart_rows],
+        [r[1] for r in chart_rows],
+        ud.water_goal,
+        [r[2] for r in chart_rows],
+        [r[3] for r in chart_rows],
+        [ud.calorie_goal - r[2] + r[3] if r[2] else float("nan") for r in chart_rows],
+    )
+    outbox.reply_photo(
+        update.message, photo=io.BytesIO(png), caption=f"Динамика за {days} дн. (по вчерашний день)"
     )
-    update.message.reply_photo(photo=buf, caption="Графики воды и калорий.")
 
 def recommend_command(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     if user_id not in users:
-        update.message.reply_text("Сначала /set_profile.")
+        outbox.reply_text(update.message, "Сначала /set_profile.")
         return
     check_and_reset_day(users[user_id])
     ud = users[user_id]
-    bal = ud["calorie_goal"] - ud["logged_calories"] + ud["burned_calories"]
-    low = ["Огурцы","Яблоки","Салат","Творог 0%"]
-    high = ["Орехи","Сыры","Авокадо","Шоколад"]
-    work = ["Ходьба 30 мин","Бег 20 мин","Плавание 15 мин","Йога 40 мин"]
-    if bal < 0:
-        msg_food = f"Добавьте больше низкокалорийных продуктов: {low}"
-        msg_work = f"Доп активность: {work[0]}"
+    bal = ud.calorie_goal - ud.logged_calories + ud.burned_calories
+    outbox.reply_text(update.message, recommender.text(bal, ud.weight))
+
+def _tz_label(ud: UserState) -> str:
+    return format_offset(clock.offset_at(time.time(), ud.tz_offset))
+
+def _day_label(day: int) -> str:
+    return date.fromordinal(day).strftime("%Y-%m-%d") if day else "—"
+
+def place_and_date(ud: UserState) -> str:
+    return f"Город: {ud.city} ({_tz_label(ud)}), Дата: {_day_label(ud.current_date)}"
+
+def timezone_command(update: Update, context: CallbackContext):
+    user_id = update.effective_user.id
+    if user_id not in users:
+        outbox.reply_text(update.message, "Сначала /set_profile.")
+        return
+    ud = users[user_id]
+    arg = " ".join(context.args).strip().lower()
+    if not arg:
+        outbox.reply_text(update.message, f"Часовой пояс: {_tz_label(ud)}.\n{TZ_USAGE}")
+        return
+    if arg == "auto":
+        weather = lookup_city(ud.city)
+        offset = None if weather is None else weather[1]
+        if offset is None:
+            outbox.reply_text(update.message, f"Не удалось определить часовой пояс для города {ud.city}.")
+            return
     else:
-        msg_food = f"Прибавьте что-то калорийное: {high}"
-        msg_work = f"Для формы: {work[1]}"
-    text = f"Баланс: {round(bal,1)} ккал\n{msg_food}\n{msg_work}"
-    update.message.reply_text(text)
+        m = TZ_PATTERN.match(arg)
+        if not m:
+            outbox.reply_text(update.message, TZ_USAGE)
+            return
+        sign, hours, minutes = m.groups()
+        offset = (int(hours) * 3600 + int(minutes or 0) * 60) * (-1 if sign == "-" else 1)
+        if int(minutes or 0) >= 60 or not TZ_MIN_OFFSET <= offset <= TZ_MAX_OFFSET:
+            outbox.reply_text(update.message, "Смещение должно быть от UTC-12:00 до UTC+14:00.")
+            return
+    users.set_tz_offset(user_id, offset, manual=arg != "auto")
+    text = f"Часовой пояс: {format_offset(offset)}. Сегодня: {_day_label(ud.current_date)}."
+    outbox.reply_text(update.message, text)
 
 def profile_command(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     if user_id not in users:
-        update.message.reply_text("Нет профиля. /set_profile.")
+        outbox.reply_text(update.message, "Нет профиля. /set_profile.")
         return
     ud = users[user_id]
     text = (
-        f"Вес: {ud.get('weight')} кг, Рост: {ud.get('height')} см, "
-        f"Возраст: {ud.get('age')}, Пол: {ud.get('gender')}\n"
-        f"Активность: {ud.get('activity')} мин/д\n"
-        f"Город: {ud.get('city')}, Дата: {ud.get('current_date')}\n"
-        f"Вода: {ud.get('water_goal')} мл, Калории: {ud.get('calorie_goal')} ккал"
+        f"Вес: {ud.weight} кг, Рост: {ud.height} см, "
+        f"Возраст: {ud.age}, Пол: {ud.gender}\n"
+        f"Активность: {ud.activity} мин/д\n"
+        f"{place_and_date(ud)}\n"
+        f"Вода: {ud.water_goal} мл, Калории: {ud.calorie_goal} ккал"
     )
-    update.message.reply_text(text)
+    outbox.reply_text(update.message, text)
 
 def menu_command(update: Update, context: CallbackContext):
     kbd = [
@@ -307,7 +477,7 @@ def menu_command(update: Update, context: CallbackContext):
         ]
     ]
     rm = InlineKeyboardMarkup(kbd)
-    update.message.reply_text("Выберите действие:", reply_markup=rm)
+    outbox.reply_text(update.message, "Выберите действие:", reply_markup=rm)
 
 def menu_callback(update: Update, context: CallbackContext):
     query = update.callback_query
@@ -315,46 +485,24 @@ def menu_callback(update: Update, context: CallbackContext):
     user_id = query.from_user.id
     query.answer()
     if user_id not in users:
-        query.edit_message_text("Нет профиля. /set_profile")
+        outbox.edit_message_text(query, "Нет профиля. /set_profile")
         return
     check_and_reset_day(users[user_id])
     if data == "MENU_PROFILE":
         ud = users[user_id]
         text = (
-            f"Вес: {ud.get('weight')} кг, Рост: {ud.get('height')} см, "
-            f"Возраст: {ud.get('age')}, Пол: {ud.get('gender')}\n"
-            f"Активность: {ud.get('activity')} мин\n"
-            f"Город: {ud.get('city')}, Дата: {ud.get('current_date')}\n"
-            f"Вода: {ud.get('water_goal')} мл, Калории: {ud.get('calorie_goal')} ккал"
+            f"Вес: {ud.weight} кг, Рост: {ud.height} см, "
+            f"Возраст: {ud.age}, Пол: {ud.gender}\n"
+            f"Активность: {ud.activity} мин\n"
+            f"{place_and_date(ud)}\n"
+            f"Вода: {ud.water_goal} мл, Калории: {ud.calorie_goal} ккал"
         )
-        query.edit_message_text(text)
+        outbox.edit_message_text(query, text)
     elif data == "MENU_PROGRESS":
-        ud = users[user_id]
-        w_goal = ud["water_goal"]
-        w_logged = ud["logged_water"]
-        c_goal = ud["calorie_goal"]
-        c_logged = ud["logged_calories"]
-        c_burned = ud["burned_calories"]
-        left = max(w_goal - w_logged, 0)
-        bal = c_goal - c_logged + c_burned
-        msg = (
-            f"Вода: {w_logged:.1f}/{w_goal:.1f} мл, осталось {left:.1f}\n"
-            f"Калории: съедено {round(c_logged,1)}/{round(c_goal,1)}, "
-            f"сожжено {round(c_burned,1)}, баланс {round(bal,1)}"
-        )
-        query.edit_message_text(msg)
+        outbox.edit_message_text(query, progress_text(users[user_id]))
     elif data == "MENU_RECOMMEND":
         ud = users[user_id]
-        bal = ud["calorie_goal"] - ud["logged_calories"] + ud["burned_calories"]
-        low = ["Огурцы","Яблоки","Салат","Творог 0%"]
-        high = ["Орехи","Сыры","Авокадо","Шоколад"]
-        wrk = ["Ходьба 30 мин","Бег 20 мин","Плавание 15 мин","Йога 40 мин"]
-        if bal < 0:
-            mf = f"Добавьте низкокалорийное: {low}"
-            mw = f"Доп активность: {wrk[0]}"
-        else:
-            mf = f"Прибавьте калорийное: {high}"
-            mw = f"Для формы: {wrk[1]}"
-        query.edit_message_text(f"Баланс: {round(bal,1)}\n{mf}\n{mw}")
+        bal = ud.calorie_goal - ud.logged_calories + ud.burned_calories
+        outbox.edit_message_text(query, recommender.text(bal, ud.weight))
     else:
-        query.edit_message_text("Неизвестная команда.")
+        outbox.edit_message_text(query, "Неизвестная команда.")
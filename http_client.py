@@ -0,0 +1,156 @@
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from config import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_RETRIES, HTTP_BACKOFF, HTTP_POOL_SIZE,
+    HTTP_TOTAL_TIMEOUT, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT
+)
+from metrics import upstream_latency, upstream_errors
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class HttpClient:
+    def __init__(self, connect_timeout: float, read_timeout: float, retries: int,
+                 backoff: float, pool_size: int, total_timeout: float):
+        self.timeout = (connect_timeout, read_timeout)
+        self.total_timeout = total_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _session(self, host: str):
+        session = self._sessions.get(host)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._sessions[host] = session
+        return session
+
+    def breaker(self, upstream: str) -> CircuitBreaker:
+        breaker = self._breakers.get(upstream)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    upstream, CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+                )
+        return breaker
+
+    def warm(self, *urls):
+        for url in urls:
+            self._session(urlsplit(url).netloc)
+
+    def get(self, upstream: str, url: str, params=None):
+        start = time.perf_counter()
+        try:
+            return self._get(upstream, url, params)
+        except UpstreamError:
+            upstream_errors.inc(upstream)
+            raise
+        finally:
+            upstream_latency.observe(time.perf_counter() - start, upstream)
+
+    def _get(self, upstream: str, url: str, params=None):
+        import requests
+
+        breaker = self.breaker(upstream)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{upstream}: circuit open")
+        session = self._session(urlsplit(url).netloc)
+        error = None
+        succeeded = False
+        attempts = 0
+        deadline = time.monotonic() + self.total_timeout
+        # Whatever escapes the loop must still be recorded, or a half-open probe
+        # would leave the breaker stuck with no one allowed to retry.
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    delay = self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                    if time.monotonic() + delay + sum(self.timeout) > deadline:
+                        break
+                    time.sleep(delay)
+                attempts += 1
+                try:
+                    response = session.get(url, params=params, timeout=self.timeout)
+                except requests.RequestException as e:
+                    error = e
+                    continue
+                if response.status_code in RETRY_STATUSES:
+                    error = UpstreamError(f"{upstream}: HTTP {response.status_code}")
+                    continue
+                succeeded = True
+                return response
+        finally:
+            if succeeded:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+        logger.warning("%s failed after %d attempts: %s", upstream, attempts, error)
+        raise UpstreamError(f"{upstream}: {error}") from error
+
+client = HttpClient(
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    retries=HTTP_RETRIES,
+    backoff=HTTP_BACKOFF,
+    pool_size=HTTP_POOL_SIZE,
+    total_timeout=HTTP_TOTAL_TIMEOUT,
+)
@@ -0,0 +1,59 @@
+import logging
+import time
+
+from telegram.ext import CallbackContext
+
+from config import DIGEST_CHECKPOINT_PATH, DIGEST_CHUNK_SIZE, DIGEST_MAX_QUEUED
+from digest import DigestBroadcast
+from handlers import users, progress_text
+from metrics import registry
+from plotting import renderer
+from sender import outbox
+from utils import lookup_city, calculate_water_goals, calculate_calorie_goals
+
+logger = logging.getLogger(__name__)
+
+digest = DigestBroadcast(
+    users, renderer, outbox, progress_text,
+    DIGEST_CHECKPOINT_PATH, DIGEST_CHUNK_SIZE, DIGEST_MAX_QUEUED
+)
+registry.gauge(
+    "bot_digest_users_per_second", "Throughput of the last daily digest run.", fn=lambda: digest.rate
+)
+
+
+def recompute_goals_job(context: CallbackContext):
+    start = time.perf_counter()
+    cities = 0
+    total = 0
+    skipped = 0
+    moved = 0
+    for city, cols in users.profile_columns(shard=context.job.context):
+        weather = lookup_city(city)
+        if weather is None:
+            # Without a real temperature the goals would be recomputed for 0 °C; keep the old ones.
+            skipped += 1
+            continue
+        temperature, tz_offset = weather
+        if tz_offset is not None:
+            # OpenWeather reports the city's current offset, so this follows DST switches.
+            for user_id, offset, manual in zip(cols["user_id"], cols["tz_offset"], cols["tz_manual"]):
+                if not manual and offset != tz_offset:
+                    users.set_tz_offset(user_id, tz_offset)
+                    moved += 1
+        water = calculate_water_goals(cols["weight"], cols["activity"], temperature)
+        calories = calculate_calorie_goals(
+            cols["weight"], cols["height"], cols["age"], cols["activity"], cols["is_male"]
+        )
+        users.update_goals(cols["user_id"], water.tolist(), calories.tolist())
+        cities += 1
+        total += len(cols["user_id"])
+    logger.info(
+        "Recomputed goals for %d users in %d cities in %.2f s "
+        "(%d cities skipped, no weather; %d users moved to a new UTC offset)",
+        total, cities, time.perf_counter() - start, skipped, moved
+    )
+
+
+def daily_digest_job(context: CallbackContext):
+    digest.run(context.bot, shard=context.job.context)
@@ -0,0 +1,78 @@
+import atexit
+import json
+import logging
+import queue
+import re
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_LEVEL, LOG_QUEUE_SIZE, LOG_REDACT, LOG_TEXT_MAX
+from metrics import registry
+
+dropped_logs = registry.counter(
+    "bot_log_records_dropped_total", "Log records dropped because the log queue was full."
+)
+
+_DIGITS = re.compile(r"\d")
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+
+
+def redact(text: str, mode: str = LOG_REDACT, limit: int = LOG_TEXT_MAX) -> str:
+    if text is None:
+        return None
+    if mode == "full":
+        return f"<{len(text)} chars>"
+    if mode == "digits":
+        text = _DIGITS.sub("#", _EMAIL.sub("<email>", text))
+    if len(text) > limit:
+        text = text[:limit] + "…"
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_logs.inc()
+
+
+class BlockingStopListener(QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def setup_logging() -> QueueListener:
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    listener = BlockingStopListener(log_queue, stream, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,53 @@
+import sys
+
+PROFILE_FIELDS = (
+    "weight", "height", "age", "gender", "activity", "city", "tz_offset", "tz_manual",
+    "water_goal", "calorie_goal",
+)
+COUNTER_FIELDS = ("current_date", "logged_water", "logged_calories", "burned_calories")
+FIELDS = PROFILE_FIELDS + COUNTER_FIELDS
+
+
+class UserState:
+    __slots__ = FIELDS
+
+    def __init__(self, weight: float = 0.0, height: float = 0.0, age: float = 0.0,
+                 gender: str = "male", activity: float = 0.0, city: str = "", tz_offset: int = None,
+                 tz_manual: bool = False, water_goal: float = 0.0, calorie_goal: float = 0.0,
+                 current_date: int = 0, logged_water: float = 0.0, logged_calories: float = 0.0,
+                 burned_calories: float = 0.0):
+        self.weight = weight
+        self.height = height
+        self.age = age
+        self.gender = sys.intern(gender)
+        self.activity = activity
+        self.city = sys.intern(city)
+        self.tz_offset = tz_offset
+        # Set by an explicit /timezone offset; otherwise tz_offset follows the city.
+        self.tz_manual = tz_manual
+        self.water_goal = water_goal
+        self.calorie_goal = calorie_goal
+        self.current_date = current_date
+        self.logged_water = logged_water
+        self.logged_calories = logged_calories
+        self.burned_calories = burned_calories
+
+    def reset_counters(self, current_date: int):
+        self.current_date = current_date
+        self.logged_water = 0.0
+        self.logged_calories = 0.0
+        self.burned_calories = 0.0
+
+    @property
+    def calorie_balance(self) -> float:
+        return self.calorie_goal - self.logged_calories + self.burned_calories
+
+    def values(self, fields=FIELDS) -> tuple:
+        return tuple(getattr(self, f) for f in fields)
+
+    @classmethod
+    def from_row(cls, row) -> "UserState":
+        return cls(**{f: v for f, v in zip(FIELDS, row) if v is not None})
+
+    def __repr__(self):
+        return f"UserState({', '.join(f'{f}={getattr(self, f)!r}' for f in FIELDS)})"
@@ -0,0 +1,56 @@
+import logging
+import threading
+from collections import deque
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+logger = logging.getLogger(__name__)
+
+
+class OrderedDispatcher(Dispatcher):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lanes = {}
+        self._lanes_lock = threading.Lock()
+
+    @staticmethod
+    def lane_key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    def pending(self) -> int:
+        with self._lanes_lock:
+            return sum(len(lane) for lane in self._lanes.values())
+
+    def process_update(self, update):
+        key = self.lane_key(update)
+        if key is None:
+            super().process_update(update)
+            return
+        with self._lanes_lock:
+            lane = self._lanes.get(key)
+            if lane is not None:
+                lane.append(update)
+                return
+            self._lanes[key] = deque([update])
+        self.run_async(self._drain, key)
+
+    def _drain(self, key):
+        while True:
+            with self._lanes_lock:
+                update = self._lanes[key][0]
+            try:
+                super().process_update(update)
+            except Exception:
+                logger.exception("Unhandled error while processing update for %s", key)
+            with self._lanes_lock:
+                lane = self._lanes[key]
+                lane.popleft()
+                if not lane:
+                    del self._lanes[key]
+                    return
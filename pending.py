@@ -0,0 +1,80 @@
+import threading
+import time
+
+from telegram import Message
+from telegram.ext import MessageFilter
+
+from config import PENDING_INPUT_TTL
+from metrics import registry
+
+PENDING_FOOD_GRAMS = "food_grams"
+PENDING_WORKOUT_CONFIRM = "workout_confirm"
+
+SWEEP_EVERY = 1024
+
+
+class PendingFilter(MessageFilter):
+    def __init__(self, inputs: "PendingInputs", kind: str):
+        self.inputs = inputs
+        self.kind = kind
+        self.name = f"PendingFilter({kind})"
+
+    def filter(self, message: Message) -> bool:
+        user = message.from_user
+        return user is not None and self.inputs.peek(user.id, self.kind) is not None
+
+
+class PendingInputs:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries = {}
+        self._inserts = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def expect(self, user_id, kind: str, payload=None, ttl: float = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[user_id] = (kind, expires, payload)
+            self._inserts += 1
+            if self._inserts % SWEEP_EVERY == 0:
+                self._sweep(time.monotonic())
+
+    def peek(self, user_id, kind: str = None):
+        # Runs as a filter on every text message, so the common miss stays a single dict lookup.
+        entry = self._entries.get(user_id)
+        if entry is None or (kind is not None and entry[0] != kind):
+            return None
+        if entry[1] <= time.monotonic():
+            with self._lock:
+                if self._entries.get(user_id) is entry:
+                    del self._entries[user_id]
+            return None
+        return entry
+
+    def pop(self, user_id, kind: str = None):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or (kind is not None and entry[0] != kind):
+                return None
+            del self._entries[user_id]
+        return entry[2] if entry[1] > time.monotonic() else None
+
+    def cancel(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def _sweep(self, now: float):
+        expired = [user_id for user_id, entry in self._entries.items() if entry[1] <= now]
+        for user_id in expired:
+            del self._entries[user_id]
+
+    def filter(self, kind: str) -> PendingFilter:
+        return PendingFilter(self, kind)
+
+
+pending = PendingInputs(PENDING_INPUT_TTL)
+
+registry.gauge("bot_pending_inputs", "Users the bot is waiting on for a follow-up reply.", fn=lambda: len(pending))
@@ -0,0 +1,238 @@
+import io
+import logging
+import threading
+import time
+
+from cache import TTLCache
+from config import PLOT_WORKERS, PLOT_CACHE_SIZE, PLOT_QUANTUM, REPORT_CACHE_TTL
+from metrics import registry, upstream_latency
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressFigure:
+    def __init__(self):
+        import matplotlib
+        matplotlib.use("Agg")
+        from matplotlib.figure import Figure
+
+        self.fig = Figure(figsize=(8, 4))
+        self.ax_water, self.ax_cal = self.fig.subplots(1, 2)
+        self.fig.subplots_adjust(left=0.09, right=0.97, bottom=0.1, top=0.9, wspace=0.35)
+
+        self.water_done = self.ax_water.bar(["Выпито"], [0], color="blue", label="Выпито")[0]
+        self.water_left = self.ax_water.bar(["Выпито"], [0], color="lightblue", label="Осталось")[0]
+        self.ax_water.set_title("Вода (мл)")
+
+        self.cal_eaten = self.ax_cal.bar(["Калории"], [0], color="red", label="Съедено")[0]
+        self.cal_burned = self.ax_cal.bar(["Калории"], [0], color="green", label="Сожжено")[0]
+        self.cal_goal = self.ax_cal.axhline(y=0, color="black", linestyle="--", label="Цель")
+        self.ax_cal.set_title("Калории (ккал)")
+        self.ax_cal.legend()
+
+    def render(self, w_logged, w_goal, c_logged, c_goal, c_burned) -> bytes:
+        self.water_done.set_height(w_logged)
+        self.water_left.set_y(w_logged)
+        self.water_left.set_height(max(w_goal - w_logged, 0))
+        self.water_left.set_visible(w_goal > w_logged)
+        if w_goal > w_logged:
+            self.ax_water.legend([self.water_done, self.water_left], ["Выпито", "Осталось"])
+        else:
+            self.ax_water.legend([self.water_done], ["Выпито"])
+        self.ax_water.set_ylim([0, max(w_goal, w_logged) * 1.1 or 1])
+
+        self.cal_eaten.set_height(c_logged)
+        self.cal_burned.set_y(c_logged)
+        self.cal_burned.set_height(c_burned)
+        self.cal_goal.set_ydata([c_goal, c_goal])
+        self.ax_cal.set_ylim([0, max(c_goal, c_logged + c_burned) * 1.1 or 1])
+
+        buf = io.BytesIO()
+        self.fig.savefig(buf, format="png")
+        return buf.getvalue()
+
+
+class ReportFigure:
+    def __init__(self, days: int):
+        import matplotlib
+        matplotlib.use("Agg")
+        from matplotlib.figure import Figure
+
+        x = list(range(days))
+        zeros = [0] * days
+        self.fig = Figure(figsize=(9, 6))
+        self.ax_water, self.ax_cal = self.fig.subplots(2, 1, sharex=True)
+        self.fig.subplots_adjust(left=0.09, right=0.97, bottom=0.1, top=0.93, hspace=0.25)
+
+        self.water = self.ax_water.bar(x, zeros, color="blue", label="Выпито")
+        self.water_goal = self.ax_water.axhline(y=0, color="black", linestyle="--", label="Цель")
+        self.ax_water.set_title("Вода (мл)")
+        self.ax_water.legend(loc="upper left")
+
+        width = 0.4
+        self.eaten = self.ax_cal.bar([i - width / 2 for i in x], zeros, width, color="red", label="Съедено")
+        self.burned = self.ax_cal.bar([i + width / 2 for i in x], zeros, width, color="green", label="Сожжено")
+        self.balance, = self.ax_cal.plot(x, zeros, color="black", marker="o", label="Баланс")
+        self.ax_cal.axhline(y=0, color="gray", linewidth=0.8)
+        self.ax_cal.set_title("Калории (ккал)")
+        self.ax_cal.legend(loc="upper left")
+        self.ax_cal.set_xticks(x)
+
+    def render(self, labels, water, water_goal, eaten, burned, balance) -> bytes:
+        for bar, value in zip(self.water, water):
+            bar.set_height(value)
+        self.water_goal.set_ydata([water_goal, water_goal])
+        self.ax_water.set_ylim([0, max(max(water), water_goal) * 1.15 or 1])
+
+        for bar, value in zip(self.eaten, eaten):
+            bar.set_height(value)
+        for bar, value in zip(self.burned, burned):
+            bar.set_height(value)
+        self.balance.set_ydata(balance)
+        known = [b for b in balance if b == b]
+        low = min([0.0] + known)
+        high = max([0.0] + list(eaten) + list(burned) + known)
+        self.ax_cal.set_ylim([low * 1.15, high * 1.15 or 1])
+
+        step = max(1, len(labels) // 10)
+        self.ax_cal.set_xticklabels([label if i % step == 0 else "" for i, label in enumerate(labels)])
+
+        buf = io.BytesIO()
+        self.fig.savefig(buf, format="png")
+        return buf.getvalue()
+
+
+_figures = {}
+_figure_lock = threading.Lock()
+
+
+def _init_worker():
+    _figures["progress"] = ProgressFigure()
+
+
+def _figure(key, factory):
+    figure = _figures.get(key)
+    if figure is None:
+        figure = _figures[key] = factory()
+    return figure
+
+
+def _render(values: tuple) -> bytes:
+    with _figure_lock:
+        return _figure("progress", ProgressFigure).render(*values)
+
+
+def _render_report(labels, water, water_goal, eaten, burned, balance) -> bytes:
+    with _figure_lock:
+        figure = _figure(("report", len(labels)), lambda: ReportFigure(len(labels)))
+        return figure.render(labels, water, water_goal, eaten, burned, balance)
+
+
+class PlotRenderer:
+    def __init__(self, workers: int, cache_size: int, quantum: float):
+        self.workers = workers
+        self.quantum = quantum
+        self.cache = TTLCache(ttl=None, maxsize=cache_size)
+        self.report_cache = TTLCache(ttl=REPORT_CACHE_TTL, maxsize=cache_size)
+        self.renders = 0
+        self.render_seconds = 0.0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        if self._pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker,
+                    )
+        return self._pool
+
+    def quantize(self, *values) -> tuple:
+        q = self.quantum
+        return tuple(round(v / q) * q for v in values)
+
+    def _run(self, kind: str, func, *args) -> bytes:
+        start = time.perf_counter()
+        if self.workers > 0:
+            png = self._executor().submit(func, *args).result()
+        else:
+            png = func(*args)
+        elapsed = time.perf_counter() - start
+        upstream_latency.observe(elapsed, kind)
+        self.renders += 1
+        self.render_seconds += elapsed
+        return png
+
+    def _render(self, values: tuple) -> bytes:
+        start = time.perf_counter()
+        png = self._run("plot_render", _render, values)
+        logger.info(
+            "Rendered progress plot in %.1f ms (cache hit rate %.0f%%)",
+            (time.perf_counter() - start) * 1000, self.cache.stats()["hit_rate"] * 100
+        )
+        return png
+
+    def render_progress(self, w_logged, w_goal, c_logged, c_goal, c_burned) -> bytes:
+        key = self.quantize(w_logged, w_goal, c_logged, c_goal, c_burned)
+        return self.cache.get(key, self._render)
+
+    def render_progress_many(self, rows) -> list:
+        keys = [self.quantize(*row) for row in rows]
+        pngs = {key: self.cache.peek(key) for key in keys}
+        todo = [key for key, png in pngs.items() if png is None]
+        if todo:
+            start = time.perf_counter()
+            if self.workers > 0:
+                pool = self._executor()
+                futures = [pool.submit(_render, key) for key in todo]
+                rendered = [future.result() for future in futures]
+            else:
+                rendered = [_render(key) for key in todo]
+            elapsed = time.perf_counter() - start
+            upstream_latency.observe(elapsed, "plot_render_batch")
+            self.renders += len(todo)
+            self.render_seconds += elapsed
+            for key, png in zip(todo, rendered):
+                self.cache.put(key, png)
+                pngs[key] = png
+        return [pngs[key] for key in keys]
+
+    def render_report(self, key, labels, water, water_goal, eaten, burned, balance) -> bytes:
+        return self.report_cache.get(
+            key,
+            lambda _: self._run(
+                "report_render", _render_report, labels, water, water_goal, eaten, burned, balance
+            )
+        )
+
+    def warm(self):
+        if self.workers > 0:
+            pool = self._executor()
+            for future in [pool.submit(_render, (0, 0, 0, 0, 0)) for _ in range(self.workers)]:
+                future.result()
+        else:
+            _render((0, 0, 0, 0, 0))
+
+    def stats(self) -> dict:
+        stats = self.cache.stats()
+        stats["renders"] = self.renders
+        stats["avg_render_ms"] = self.render_seconds * 1000 / self.renders if self.renders else 0.0
+        return stats
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+renderer = PlotRenderer(PLOT_WORKERS, PLOT_CACHE_SIZE, PLOT_QUANTUM)
+
+registry.gauge(
+    "bot_plot_cache_hit_ratio", "Share of progress plots served from the PNG cache.",
+    fn=lambda: renderer.cache.stats()["hit_rate"]
+)
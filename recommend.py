@@ -0,0 +1,149 @@
+import math
+import threading
+
+MET_VALUES = {
+    "бег":9.8, "running":9.8, "ходьба":3.5, "walking":3.5,
+    "плавание":7.0, "swimming":7.0, "велосипед":6.0, "cycling":6.0,
+    "йога":3.0, "yoga":3.0
+}
+DEFAULT_MET = 5.0
+WORKOUT_TYPES = ("ходьба", "йога", "велосипед", "плавание", "бег")
+
+# name, kcal / 100 g, protein g / 100 g, min portion g, max portion g
+FOODS = (
+    ("Огурцы", 15, 0.8, 100, 400),
+    ("Салат", 16, 1.5, 50, 300),
+    ("Помидоры", 20, 1.1, 100, 400),
+    ("Брокколи", 34, 2.8, 100, 300),
+    ("Яблоки", 52, 0.3, 100, 300),
+    ("Апельсин", 47, 0.9, 100, 300),
+    ("Банан", 89, 1.1, 100, 250),
+    ("Кефир 1%", 40, 3.0, 200, 500),
+    ("Творог 0%", 71, 16.5, 100, 300),
+    ("Греческий йогурт", 66, 10.0, 100, 300),
+    ("Яйца", 155, 12.6, 50, 200),
+    ("Куриная грудка", 165, 31.0, 100, 300),
+    ("Индейка", 135, 29.0, 100, 300),
+    ("Треска", 82, 18.0, 100, 300),
+    ("Лосось", 208, 20.0, 100, 250),
+    ("Говядина", 250, 26.0, 100, 250),
+    ("Гречка варёная", 110, 4.2, 150, 350),
+    ("Рис варёный", 130, 2.7, 150, 350),
+    ("Овсянка на воде", 88, 3.0, 150, 350),
+    ("Макароны варёные", 158, 5.8, 150, 350),
+    ("Картофель", 77, 2.0, 150, 400),
+    ("Цельнозерновой хлеб", 247, 13.0, 30, 120),
+    ("Сыр", 350, 25.0, 20, 80),
+    ("Авокадо", 160, 2.0, 50, 200),
+    ("Орехи", 607, 20.0, 15, 60),
+    ("Арахисовая паста", 588, 25.0, 15, 50),
+    ("Тёмный шоколад", 546, 5.0, 10, 50),
+)
+
+BUCKET_KCAL = 25
+MAX_BUDGET = 1500
+MEAL_MAX = 700
+TOP_N = 3
+PROTEIN_WEIGHT = 0.5
+GRAMS_STEP = 10
+WORKOUT_MIN_STEP = 5
+WORKOUT_MAX_MIN = 120
+FITNESS_MINUTES = 30
+DEFAULT_WEIGHT = 70.0
+
+
+class Recommender:
+    def __init__(self, foods=FOODS, step: int = BUCKET_KCAL, max_budget: int = MAX_BUDGET,
+                 meal_max: int = MEAL_MAX, top: int = TOP_N):
+        self.foods = foods
+        self.step = step
+        self.max_budget = max_budget
+        self.meal_max = meal_max
+        self.top = top
+        self._buckets = None
+        self._lock = threading.Lock()
+
+    def warm(self):
+        self._index()
+
+    def _index(self) -> list:
+        buckets = self._buckets
+        if buckets is None:
+            with self._lock:
+                if self._buckets is None:
+                    self._buckets = self._build()
+                buckets = self._buckets
+        return buckets
+
+    def _build(self) -> list:
+        import numpy as np
+        kcal = np.array([f[1] for f in self.foods], dtype=float)
+        protein = np.array([f[2] for f in self.foods], dtype=float)
+        lo = np.array([f[3] for f in self.foods], dtype=float)
+        hi = np.array([f[4] for f in self.foods], dtype=float)
+
+        # Each bucket is planned for its lower edge, and foods whose smallest portion is above
+        # that edge are dropped, so a suggestion never exceeds the budget. Bucket 0 has no
+        # budget to plan for; it lists the lightest portions, for users at or over their goal.
+        edges = np.arange(0, self.max_budget + self.step, self.step, dtype=float)
+        targets = np.clip(edges, self.step / 2, self.meal_max)[:, None]
+        grams = np.clip(targets * 100 / kcal, lo, hi)
+        grams = np.maximum(np.floor(grams / GRAMS_STEP) * GRAMS_STEP, lo)
+        portion = grams * kcal / 100
+        fits = (portion <= edges[:, None]) | (edges[:, None] == 0)
+        miss = (portion - targets) / targets
+        fit = 1 - np.abs(miss) - 2 * np.maximum(miss, 0)
+        score = np.where(fits, fit + PROTEIN_WEIGHT * (protein * 4 / kcal), -np.inf)
+        order = np.argsort(-score, axis=1, kind="stable")[:, :self.top]
+
+        return [
+            tuple(
+                (self.foods[i][0], int(grams[b, i]), int(round(portion[b, i])))
+                for i in row if fits[b, i]
+            )
+            for b, row in enumerate(order.tolist())
+        ]
+
+    def foods_for(self, budget: float) -> tuple:
+        buckets = self._index()
+        b = int(budget // self.step) if budget > 0 else 0
+        return buckets[min(b, len(buckets) - 1)]
+
+    def workouts_for(self, gap: float, weight: float) -> list:
+        weight = weight if weight > 0 else DEFAULT_WEIGHT
+        result = []
+        for wtype in WORKOUT_TYPES:
+            minutes = gap * 60 / (MET_VALUES[wtype] * weight)
+            minutes = max(math.ceil(minutes / WORKOUT_MIN_STEP), 1) * WORKOUT_MIN_STEP
+            if minutes <= WORKOUT_MAX_MIN:
+                result.append((wtype, minutes))
+        result.sort(key=lambda w: w[1])
+        return result[:self.top]
+
+    def text(self, balance: float, weight: float) -> str:
+        lines = [f"Баланс: {round(balance,1)} ккал"]
+        foods = ", ".join(f"{name} {grams} г (~{cals} ккал)" for name, grams, cals in self.foods_for(balance))
+        # Over or at the goal the lightest portions are still offered, as the old static
+        # advice did with its low-calorie list, but labelled so nobody reads them as a budget.
+        if balance < 0:
+            lines.append(f"Норма превышена. Если голодны, самое лёгкое: {foods}")
+            workouts = self.workouts_for(-balance, weight)
+            if workouts:
+                lines.append(
+                    "Чтобы закрыть разницу: "
+                    + ", ".join(f"{wtype} {minutes} мин" for wtype, minutes in workouts)
+                )
+            else:
+                lines.append(f"Разница больше {WORKOUT_MAX_MIN} мин любой тренировки — разделите её на несколько дней.")
+        else:
+            if balance < self.step:
+                lines.append(f"Норма почти набрана. Если голодны, самое лёгкое: {foods}")
+            else:
+                lines.append(f"Можно съесть: {foods}")
+            wtype = WORKOUT_TYPES[0]
+            burned = MET_VALUES[wtype] * (weight if weight > 0 else DEFAULT_WEIGHT) * FITNESS_MINUTES / 60
+            lines.append(f"Для формы: {wtype} {FITNESS_MINUTES} мин (~{int(burned)} ккал)")
+        return "\n".join(lines)
+
+
+recommender = Recommender()
@@ -0,0 +1,257 @@
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+
+from telegram.error import RetryAfter, TelegramError
+
+from config import SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_WORKERS
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE, PRIORITY_EDIT, PRIORITY_BULK = range(3)
+BUCKET_SWEEP_INTERVAL = 60.0
+
+send_delay = registry.histogram(
+    "bot_send_delay_seconds", "Time outgoing messages spent waiting in the send queue.", ["kind"]
+)
+coalesced_edits = registry.counter(
+    "bot_send_coalesced_edits_total", "Message edits superseded by a newer edit before sending."
+)
+flood_waits = registry.counter(
+    "bot_send_flood_waits_total", "Telegram 429 responses received by the send scheduler."
+)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        self.wait_time(now)
+        return not self.rate or self.tokens >= self.capacity
+
+    def take(self):
+        if self.rate:
+            self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("kind", "chat_id", "priority", "func", "args", "kwargs", "enqueued", "edit_key", "seq")
+
+    def __init__(self, kind, chat_id, priority, func, args, kwargs, edit_key=None, seq=0):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued = time.monotonic()
+        self.edit_key = edit_key
+        self.seq = seq
+
+
+def _payload(photo):
+    # PTB reads file objects when it builds the request, so a stream would be empty on a
+    # flood-wait retry; keep the bytes instead.
+    if hasattr(photo, "getvalue"):
+        return photo.getvalue()
+    if hasattr(photo, "read"):
+        return photo.read()
+    return photo
+
+
+class Outbox:
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, workers: int):
+        self.global_bucket = TokenBucket(global_rate, max(global_rate, 1))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = max(workers, 1)
+        # Bulk sends never take the last worker, so replies and edits always have one free.
+        self.bulk_workers = max(self.workers - 1, 1)
+        self._chat_buckets = {}
+        self._ready = []
+        self._delayed = []
+        self._pending_edits = {}
+        # chat_id -> job being sent (or waiting out a flood limit); later jobs for that
+        # chat wait in _blocked so each chat still receives messages in order.
+        self._busy = {}
+        self._blocked = {}
+        self._in_flight = 0
+        self._bulk_in_flight = 0
+        self._next_sweep = time.monotonic() + BUCKET_SWEEP_INTERVAL
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._jobs = queue.SimpleQueue()
+        self._thread = None
+
+    def set_global_rate(self, rate: float):
+        with self._cond:
+            self.global_bucket = TokenBucket(rate, max(rate, 1))
+
+    def depth(self) -> int:
+        with self._cond:
+            blocked = sum(len(entries) for entries in self._blocked.values())
+            return len(self._ready) + len(self._delayed) + blocked
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+            self._thread.start()
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f"outbox-sender-{i}", daemon=True).start()
+
+    def submit(self, kind, chat_id, func, *args, priority=PRIORITY_INTERACTIVE, edit_key=None, **kwargs):
+        with self._cond:
+            if edit_key is not None:
+                pending = self._pending_edits.get(edit_key)
+                if pending is not None:
+                    pending.args, pending.kwargs = args, kwargs
+                    coalesced_edits.inc()
+                    return
+            job = _Job(kind, chat_id, priority, func, args, kwargs, edit_key, next(self._seq))
+            if edit_key is not None:
+                self._pending_edits[edit_key] = job
+            heapq.heappush(self._ready, (priority, job.seq, job))
+            self._ensure_started()
+            self._cond.notify_all()
+
+    def reply_text(self, message, text, priority=PRIORITY_INTERACTIVE, **kwargs):
+        self.submit("message", message.chat_id, message.reply_text, text, priority=priority, **kwargs)
+
+    def reply_photo(self, message, photo, priority=PRIORITY_INTERACTIVE, **kwargs):
+        self.submit(
+            "photo", message.chat_id, message.reply_photo, photo=_payload(photo), priority=priority, **kwargs
+        )
+
+    def edit_message_text(self, query, text, **kwargs):
+        message = query.message
+        key = (message.chat_id, message.message_id) if message else query.inline_message_id
+        self.submit(
+            "edit", message.chat_id if message else None, query.edit_message_text, text,
+            priority=PRIORITY_EDIT, edit_key=key, **kwargs
+        )
+
+    def send_message(self, bot, chat_id, text, priority=PRIORITY_BULK, **kwargs):
+        self.submit("message", chat_id, bot.send_message, chat_id, text, priority=priority, **kwargs)
+
+    def send_photo(self, bot, chat_id, photo, priority=PRIORITY_BULK, **kwargs):
+        self.submit("photo", chat_id, bot.send_photo, chat_id, _payload(photo), priority=priority, **kwargs)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _sweep_buckets(self, now: float):
+        # A bucket that has refilled is indistinguishable from a new one, so drop it.
+        idle = [
+            chat_id for chat_id, bucket in self._chat_buckets.items()
+            if chat_id not in self._busy and bucket.full(now)
+        ]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+        self._next_sweep = now + BUCKET_SWEEP_INTERVAL
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now >= self._next_sweep:
+                    self._sweep_buckets(now)
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, entry = heapq.heappop(self._delayed)
+                    heapq.heappush(self._ready, entry)
+                if not self._ready or self._in_flight >= self.workers:
+                    self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+                    continue
+                entry = heapq.heappop(self._ready)
+                job = entry[2]
+                owner = self._busy.get(job.chat_id)
+                if owner is not None and owner is not job:
+                    heapq.heappush(self._blocked.setdefault(job.chat_id, []), entry)
+                    continue
+                if job.priority == PRIORITY_BULK and self._bulk_in_flight >= self.bulk_workers:
+                    heapq.heappush(self._ready, entry)
+                    self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+                    continue
+                chat_wait = self._chat_bucket(job.chat_id).wait_time(now)
+                if chat_wait:
+                    heapq.heappush(self._delayed, (now + chat_wait, entry))
+                    continue
+                global_wait = self.global_bucket.wait_time(now)
+                if global_wait:
+                    heapq.heappush(self._ready, entry)
+                    self._cond.wait(global_wait)
+                    continue
+                self._chat_bucket(job.chat_id).take()
+                self.global_bucket.take()
+                if job.edit_key is not None:
+                    self._pending_edits.pop(job.edit_key, None)
+                if job.chat_id is not None:
+                    self._busy[job.chat_id] = job
+                self._in_flight += 1
+                if job.priority == PRIORITY_BULK:
+                    self._bulk_in_flight += 1
+                return job
+
+    def _finish(self, job, retry_after=None):
+        with self._cond:
+            self._in_flight -= 1
+            if job.priority == PRIORITY_BULK:
+                self._bulk_in_flight -= 1
+            if retry_after is not None:
+                # The chat stays busy with this job, so nothing overtakes it during the wait.
+                heapq.heappush(
+                    self._delayed, (time.monotonic() + retry_after, (job.priority, job.seq, job))
+                )
+            elif self._busy.get(job.chat_id) is job:
+                del self._busy[job.chat_id]
+                blocked = self._blocked.get(job.chat_id)
+                if blocked:
+                    heapq.heappush(self._ready, heapq.heappop(blocked))
+                    if not blocked:
+                        del self._blocked[job.chat_id]
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            send_delay.observe(time.monotonic() - job.enqueued, job.kind)
+            self._jobs.put(job)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            retry_after = None
+            try:
+                job.func(*job.args, **job.kwargs)
+            except RetryAfter as e:
+                flood_waits.inc()
+                logger.warning("Flood limit hit, retrying in %s s", e.retry_after)
+                retry_after = e.retry_after
+            except TelegramError as e:
+                logger.warning("Failed to send %s to %s: %s", job.kind, job.chat_id, e)
+            except Exception:
+                logger.exception("Failed to send %s to %s", job.kind, job.chat_id)
+            finally:
+                self._finish(job, retry_after)
+
+
+outbox = Outbox(SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_WORKERS)
+
+registry.gauge("bot_send_queue_depth", "Outgoing messages waiting to be sent.", fn=outbox.depth)
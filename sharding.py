@@ -0,0 +1,140 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from telegram import Bot, Update
+from telegram.ext import Dispatcher, JobQueue, TypeHandler, Updater
+from telegram.utils.request import Request
+
+from config import (
+    TELEGRAM_BOT_TOKEN, UPDATE_WORKERS, METRICS_PORT, METRICS_ADDR, PREWARM, SEND_GLOBAL_RATE
+)
+from ordered_dispatcher import OrderedDispatcher
+
+logger = logging.getLogger(__name__)
+
+
+def make_bot() -> Bot:
+    return Bot(token=TELEGRAM_BOT_TOKEN, request=Request(con_pool_size=UPDATE_WORKERS + 4))
+
+
+def run_shard(index: int, shards: int, conn, bot_factory, workers: int, done_queue=None):
+    import bot as app
+    from log_pipeline import setup_logging
+    from metrics import start_http_server
+    from sender import outbox
+
+    setup_logging()
+    # Every shard sends with the same bot token, so they split Telegram's global limit.
+    outbox.set_global_rate(SEND_GLOBAL_RATE / shards)
+    tg_bot = bot_factory()
+    updater = app.build_updater(bot=tg_bot, workers=workers)
+    dp = updater.dispatcher
+    if done_queue is not None:
+        dp.add_handler(TypeHandler(Update, lambda u, c: done_queue.put(u.update_id)), group=1_000_000)
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT + 1 + index, METRICS_ADDR)
+    threading.Thread(target=dp.start, name=f"shard-{index}-dispatcher", daemon=True).start()
+    updater.job_queue.start()
+    app.schedule_jobs(updater.job_queue, shard=(index, shards))
+    if PREWARM:
+        threading.Thread(target=app.prewarm, name="prewarm", daemon=True).start()
+    logger.info("Shard %d started", index)
+    try:
+        while True:
+            data = conn.recv()
+            if data is None:
+                break
+            dp.update_queue.put(Update.de_json(data, tg_bot))
+    finally:
+        dp.stop()
+        updater.job_queue.stop()
+        app.users.close()
+        app.renderer.shutdown()
+
+
+class ShardPool:
+    def __init__(self, shards: int, bot_factory=make_bot, workers: int = UPDATE_WORKERS, done_queue=None):
+        self.shards = shards
+        self.bot_factory = bot_factory
+        self.workers = workers
+        self.done_queue = done_queue
+        self._ctx = multiprocessing.get_context("spawn")
+        self.pipes = [self._ctx.Pipe(duplex=False) for _ in range(shards)]
+        self.buffers = [queue.Queue() for _ in range(shards)]
+        self.processes = [None] * shards
+        self.restarts = 0
+        self._stop = threading.Event()
+        self._supervisor = None
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(
+            target=run_shard,
+            args=(index, self.shards, self.pipes[index][0], self.bot_factory, self.workers, self.done_queue),
+            name=f"shard-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+
+    def _feed(self, index: int):
+        buffer, writer = self.buffers[index], self.pipes[index][1]
+        while True:
+            data = buffer.get()
+            writer.send(data)
+            if data is None:
+                return
+
+    def start(self):
+        for index in range(self.shards):
+            self._spawn(index)
+            threading.Thread(target=self._feed, args=(index,), name=f"shard-{index}-feed", daemon=True).start()
+        self._supervisor = threading.Thread(target=self._supervise, name="shard-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def _supervise(self):
+        while not self._stop.wait(1.0):
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logger.warning("Shard %d exited with %s, restarting", index, process.exitcode)
+                    self.restarts += 1
+                    self._spawn(index)
+
+    def shard_of(self, key: int) -> int:
+        return hash(key) % self.shards
+
+    def route(self, key: int, data: dict):
+        self.buffers[self.shard_of(key)].put(data)
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        for buffer in self.buffers:
+            buffer.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+
+
+class ShardRouter(Dispatcher):
+    def __init__(self, pool: ShardPool, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = pool
+
+    def process_update(self, update):
+        key = OrderedDispatcher.lane_key(update)
+        if key is None:
+            super().process_update(update)
+            return
+        self.pool.route(key, update.to_dict())
+
+
+def build_ingress(shards: int) -> Updater:
+    pool = ShardPool(shards)
+    pool.start()
+    router = ShardRouter(pool, make_bot(), queue.Queue(), workers=1, job_queue=JobQueue())
+    router.job_queue.set_dispatcher(router)
+    return Updater(dispatcher=router, workers=None)
@@ -0,0 +1,369 @@
+import bisect
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+
+from config import STORAGE_BACKEND, STORAGE_PATH, STORAGE_FLUSH_INTERVAL
+from days import today_key, day_key
+from models import UserState, COUNTER_FIELDS, FIELDS
+
+logger = logging.getLogger(__name__)
+
+
+EVENT_WATER, EVENT_FOOD, EVENT_WORKOUT = range(3)
+
+# julianday("YYYY-MM-DD") minus this is the proleptic Gregorian ordinal used for day keys.
+JULIAN_ORDINAL_DELTA = 1721424.5
+
+
+def _fill_days(rollups: dict, days: int, today: int) -> list:
+    return [(d, *rollups.get(d, (0.0, 0.0, 0.0))) for d in range(today - days + 1, today + 1)]
+
+
+def _columns_of(rows) -> dict:
+    import numpy as np
+
+    user_ids, weight, height, age, activity, gender, tz_offset, tz_manual = zip(*rows)
+    return {
+        "user_id": list(user_ids),
+        "tz_offset": list(tz_offset),
+        "tz_manual": [bool(m) for m in tz_manual],
+        "weight": np.array(weight, dtype=np.float64),
+        "height": np.array(height, dtype=np.float64),
+        "age": np.array(age, dtype=np.float64),
+        "activity": np.array(activity, dtype=np.float64),
+        "is_male": np.array([g == "male" for g in gender], dtype=bool),
+    }
+
+
+def in_shard(user_id, shard) -> bool:
+    # shard is (index, count) in sharded mode, matching ShardPool.shard_of; None owns everyone.
+    return shard is None or hash(user_id) % shard[1] == shard[0]
+
+
+def _columns(fields) -> str:
+    return ", ".join(f'"{f}"' for f in fields)
+
+
+def _assignments(fields) -> str:
+    return ", ".join(f'"{f}" = ?' for f in fields)
+
+
+class MemoryStorage:
+    def __init__(self):
+        self._users = {}
+        self._events = {}
+        self._daily = {}
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def __getitem__(self, user_id):
+        return self._users[user_id]
+
+    def __setitem__(self, user_id, user_data):
+        self._users[user_id] = user_data
+
+    def get(self, user_id, default=None):
+        return self._users.get(user_id, default)
+
+    def save(self, user_id):
+        pass
+
+    def touch(self, user_id):
+        pass
+
+    def _tz_offset(self, user_id):
+        ud = self._users.get(user_id)
+        return None if ud is None else ud.tz_offset
+
+    def log_event(self, user_id, kind: int, amount: float, ts: float = None):
+        ts = time.time() if ts is None else ts
+        self._events.setdefault(user_id, array("d")).extend((ts, kind, amount))
+        day = day_key(ts, self._tz_offset(user_id))
+        totals = self._daily.setdefault(user_id, {}).setdefault(day, [0.0, 0.0, 0.0])
+        totals[kind] += amount
+
+    def events(self, user_id, since: float = 0.0) -> list:
+        log = self._events.get(user_id, ())
+        return [
+            (log[i], int(log[i + 1]), log[i + 2])
+            for i in range(0, len(log), 3) if log[i] >= since
+        ]
+
+    def daily_totals(self, user_id, days: int, today: int = None) -> list:
+        today = today_key(self._tz_offset(user_id)) if today is None else today
+        return _fill_days(self._daily.get(user_id, {}), days, today)
+
+    def profile_columns(self, shard=None):
+        by_city = {}
+        for user_id, ud in list(self._users.items()):
+            if ud.city and ud.calorie_goal and in_shard(user_id, shard):
+                by_city.setdefault(ud.city, []).append(
+                    (user_id, ud.weight, ud.height, ud.age, ud.activity, ud.gender,
+                     ud.tz_offset, ud.tz_manual)
+                )
+        for city, rows in by_city.items():
+            yield city, _columns_of(rows)
+
+    def iter_users(self, chunk_size: int, after=None):
+        user_ids = sorted(self._users)
+        start = 0 if after is None else bisect.bisect_right(user_ids, after)
+        for i in range(start, len(user_ids), chunk_size):
+            chunk = [(uid, self._users.get(uid)) for uid in user_ids[i:i + chunk_size]]
+            chunk = [(uid, ud) for uid, ud in chunk if ud is not None]
+            if chunk:
+                yield chunk
+
+    def set_tz_offset(self, user_id, tz_offset, manual: bool = False):
+        ud = self[user_id]
+        ud.tz_offset = tz_offset
+        ud.tz_manual = manual
+        # The new offset may put "today" on another calendar day; take that day's counters
+        # from the daily rollups instead of zeroing them.
+        day, water, calories, burned = self.daily_totals(user_id, 1)[0]
+        ud.current_date = day
+        ud.logged_water, ud.logged_calories, ud.burned_calories = water, calories, burned
+        self.save(user_id)
+
+    def update_goals(self, user_ids, water_goals, calorie_goals):
+        for user_id, wg, cg in zip(user_ids, water_goals, calorie_goals):
+            ud = self._users.get(user_id)
+            if ud is not None:
+                ud.water_goal = wg
+                ud.calorie_goal = cg
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage(MemoryStorage):
+    CREATE_USERS_SQL = (
+        "CREATE TABLE IF NOT EXISTS users ("
+        "user_id INTEGER PRIMARY KEY, weight REAL, height REAL, age REAL, gender TEXT, "
+        "activity REAL, city TEXT, tz_offset INTEGER, tz_manual INTEGER, water_goal REAL, calorie_goal REAL, "
+        "\"current_date\" INTEGER, logged_water REAL, logged_calories REAL, burned_calories REAL)"
+    )
+    SELECT_SQL = f"SELECT {_columns(FIELDS)} FROM users WHERE user_id = ?"
+    UPSERT_SQL = (
+        f"INSERT OR REPLACE INTO users (user_id, {_columns(FIELDS)}) "
+        f"VALUES (?, {', '.join('?' * len(FIELDS))})"
+    )
+    UPDATE_COUNTERS_SQL = (
+        f"UPDATE users SET {_assignments(COUNTER_FIELDS)} WHERE user_id = ?"
+    )
+    SELECT_PROFILES_SQL = (
+        "SELECT city, user_id, weight, height, age, activity, gender, tz_offset, tz_manual FROM users "
+        "WHERE city IS NOT NULL AND city != '' AND calorie_goal IS NOT NULL ORDER BY city"
+    )
+    SELECT_USERS_AFTER_SQL = (
+        f"SELECT user_id, {_columns(FIELDS)} FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?"
+    )
+    UPDATE_GOALS_SQL = "UPDATE users SET water_goal = ?, calorie_goal = ? WHERE user_id = ?"
+    INSERT_EVENT_SQL = "INSERT INTO events (user_id, ts, kind, amount) VALUES (?, ?, ?, ?)"
+    SELECT_EVENTS_SQL = "SELECT ts, kind, amount FROM events WHERE user_id = ? AND ts >= ? ORDER BY ts"
+    UPSERT_DAILY_SQL = (
+        "INSERT INTO daily (user_id, day, water, calories, burned) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (user_id, day) DO UPDATE SET "
+        "water = water + excluded.water, calories = calories + excluded.calories, "
+        "burned = burned + excluded.burned"
+    )
+    SELECT_DAILY_SQL = (
+        "SELECT day, water, calories, burned FROM daily "
+        "WHERE user_id = ? AND day BETWEEN ? AND ?"
+    )
+
+    def __init__(self, path: str, flush_interval: float):
+        super().__init__()
+        self._path = path
+        self._missing = set()
+        self._dirty = set()
+        self._pending_events = []
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, cached_statements=16)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(self.CREATE_USERS_SQL)
+        self._migrate_users()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "user_id INTEGER NOT NULL, ts REAL NOT NULL, kind INTEGER NOT NULL, amount REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS events_user_ts ON events (user_id, ts)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS daily ("
+            "user_id INTEGER NOT NULL, day INTEGER NOT NULL, "
+            "water REAL NOT NULL DEFAULT 0, calories REAL NOT NULL DEFAULT 0, "
+            "burned REAL NOT NULL DEFAULT 0, PRIMARY KEY (user_id, day)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self._stop = threading.Event()
+        self._flush_interval = flush_interval
+        self._flusher = threading.Thread(target=self._flush_loop, name="storage-flush", daemon=True)
+        self._flusher.start()
+
+    def _migrate_users(self):
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(users)")]
+        if "tz_offset" in columns:
+            if "tz_manual" not in columns:
+                with self._conn:
+                    self._conn.execute("ALTER TABLE users ADD COLUMN tz_manual INTEGER")
+            return
+        # Before tz_offset existed, current_date was a TEXT "YYYY-MM-DD" in server time;
+        # rebuild the table so it becomes an INTEGER day ordinal.
+        old = [c for c in columns if c != "current_date"]
+        with self._conn:
+            self._conn.execute("ALTER TABLE users RENAME TO users_old")
+            self._conn.execute(self.CREATE_USERS_SQL)
+            self._conn.execute(
+                f'INSERT INTO users ({_columns(old)}, "current_date") '
+                f'SELECT {_columns(old)}, '
+                f'CAST(julianday("current_date") - {JULIAN_ORDINAL_DELTA} AS INTEGER) FROM users_old'
+            )
+            self._conn.execute("DROP TABLE users_old")
+        logger.info("Migrated users table to integer day keys")
+
+    def _load(self, user_id):
+        if user_id in self._users:
+            return self._users[user_id]
+        if user_id in self._missing:
+            return None
+        with self._lock:
+            row = self._conn.execute(self.SELECT_SQL, (user_id,)).fetchone()
+        if row is None:
+            self._missing.add(user_id)
+            return None
+        user_data = UserState.from_row(row)
+        self._users[user_id] = user_data
+        return user_data
+
+    def __contains__(self, user_id):
+        return self._load(user_id) is not None
+
+    def __getitem__(self, user_id):
+        user_data = self._load(user_id)
+        if user_data is None:
+            raise KeyError(user_id)
+        return user_data
+
+    def __setitem__(self, user_id, user_data):
+        self._missing.discard(user_id)
+        self._users[user_id] = user_data
+
+    def get(self, user_id, default=None):
+        user_data = self._load(user_id)
+        return default if user_data is None else user_data
+
+    def save(self, user_id):
+        ud = self._users[user_id]
+        with self._lock:
+            self._dirty.discard(user_id)
+            with self._conn:
+                self._conn.execute(self.UPSERT_SQL, (user_id, *ud.values()))
+
+    def touch(self, user_id):
+        with self._lock:
+            self._dirty.add(user_id)
+
+    def log_event(self, user_id, kind: int, amount: float, ts: float = None):
+        ts = time.time() if ts is None else ts
+        day = day_key(ts, self._tz_offset(user_id))
+        with self._lock:
+            self._pending_events.append((user_id, ts, kind, amount, day))
+
+    def events(self, user_id, since: float = 0.0) -> list:
+        self.flush()
+        with self._lock:
+            return self._conn.execute(self.SELECT_EVENTS_SQL, (user_id, since)).fetchall()
+
+    def daily_totals(self, user_id, days: int, today: int = None) -> list:
+        today = today_key(self._tz_offset(user_id)) if today is None else today
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                self.SELECT_DAILY_SQL, (user_id, today - days + 1, today)
+            ).fetchall()
+        return _fill_days({r[0]: r[1:] for r in rows}, days, today)
+
+    def profile_columns(self, shard=None):
+        # A separate WAL reader streams the scan one city at a time without holding
+        # the write connection's lock while the caller fetches weather.
+        conn = sqlite3.connect(self._path)
+        try:
+            rows = conn.execute(self.SELECT_PROFILES_SQL)
+            for city, group in itertools.groupby(rows, key=lambda r: r[0]):
+                owned = [r[1:] for r in group if in_shard(r[1], shard)]
+                if owned:
+                    yield city, _columns_of(owned)
+        finally:
+            conn.close()
+
+    def iter_users(self, chunk_size: int, after=None):
+        self.flush()
+        after = -(1 << 63) if after is None else after
+        while True:
+            with self._lock:
+                rows = self._conn.execute(self.SELECT_USERS_AFTER_SQL, (after, chunk_size)).fetchall()
+            if not rows:
+                return
+            # Cached users may hold counters newer than the last flush; rows not in the
+            # cache are materialised for this chunk only so a broadcast does not fill it.
+            yield [
+                (row[0], self._users.get(row[0]) or UserState.from_row(row[1:])) for row in rows
+            ]
+            after = rows[-1][0]
+
+    def update_goals(self, user_ids, water_goals, calorie_goals):
+        super().update_goals(user_ids, water_goals, calorie_goals)
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    self.UPDATE_GOALS_SQL, zip(water_goals, calorie_goals, user_ids)
+                )
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty and not self._pending_events:
+                return
+            rows = []
+            for user_id in self._dirty:
+                ud = self._users.get(user_id)
+                if ud is not None:
+                    rows.append((*ud.values(COUNTER_FIELDS), user_id))
+            self._dirty.clear()
+            events, self._pending_events = self._pending_events, []
+            rollups = {}
+            for user_id, ts, kind, amount, day in events:
+                totals = rollups.setdefault((user_id, day), [0.0, 0.0, 0.0])
+                totals[kind] += amount
+            with self._conn:
+                self._conn.executemany(self.UPDATE_COUNTERS_SQL, rows)
+                self._conn.executemany(self.INSERT_EVENT_SQL, [e[:4] for e in events])
+                self._conn.executemany(
+                    self.UPSERT_DAILY_SQL, [(*key, *totals) for key, totals in rollups.items()]
+                )
+
+    def _flush_loop(self):
+        while not self._stop.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Storage flush failed")
+
+    def close(self):
+        self._stop.set()
+        self._flusher.join()
+        self.flush()
+        self._conn.close()
+
+
+def create_storage():
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(STORAGE_PATH, STORAGE_FLUSH_INTERVAL)
+    return MemoryStorage()
@@ -1,36 +1,68 @@
 import logging
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
 import io
-from datetime import datetime
-import requests
+import re
+import threading
+import time
 
-from config import OPENWEATHER_API_KEY
+from cache import TTLCache
+from config import (
+    OPENWEATHER_API_KEY, OPENWEATHER_URL, WEATHER_CACHE_TTL, WEATHER_CACHE_SIZE,
+    FOOD_SEARCH_URL, FOOD_DB_PATH, FOOD_LOOKUP_WORKERS, FOOD_LOOKUP_DEADLINE
+)
+from days import clock
+from food_db import FoodDB
+from http_client import client as http
+from metrics import registry
+from models import UserState
+from plotting import renderer
+from recommend import recommender
 
 logger = logging.getLogger(__name__)
 
-def get_weather(city: str) -> float:
+weather_cache = TTLCache(ttl=WEATHER_CACHE_TTL, maxsize=WEATHER_CACHE_SIZE)
+food_db = FoodDB(FOOD_DB_PATH)
+
+registry.gauge(
+    "bot_weather_cache_hit_ratio", "Share of weather lookups served from the city cache.",
+    fn=lambda: weather_cache.stats()["hit_rate"]
+)
+
+def _fetch_weather(city: str) -> tuple:
+    response = http.get(
+        "openweather",
+        OPENWEATHER_URL,
+        params={"q": city, "appid": OPENWEATHER_API_KEY, "units": "metric"}
+    )
+    data = response.json()
+    if str(data.get("cod")) != "200":
+        raise ValueError(f"OpenWeather error for {city!r}: {data.get('message')}")
+    timezone = data.get("timezone")
+    return float(data["main"]["temp"]), None if timezone is None else int(timezone)
+
+def lookup_city(city: str):
+    # One cached lookup gives both the temperature and the UTC offset; failures are not
+    # cached, so callers needing both must not ask twice.
     try:
-        url = (
-            "http://api.openweathermap.org/data/2.5/weather"
-            f"?q={city}&appid={OPENWEATHER_API_KEY}&units=metric"
-        )
-        response = requests.get(url)
-        data = response.json()
-        if data.get("cod") != 200:
-            return 0.0
-        return float(data["main"]["temp"])
-    except:
-        return 0.0
+        return weather_cache.get(city.strip().lower(), _fetch_weather)
+    except Exception as e:
+        logger.warning("Weather lookup failed: %s", e)
+        return None
 
-def get_food_info(product_name: str) -> dict:
+def lookup_weather(city: str):
+    weather = lookup_city(city)
+    return None if weather is None else weather[0]
+
+def get_weather(city: str) -> float:
+    temperature = lookup_weather(city)
+    return 0.0 if temperature is None else temperature
+
+def _search_food_remote(product_name: str) -> dict:
     try:
-        url = (
-            "https://world.openfoodfacts.org/cgi/search.pl"
-            f"?action=process&search_terms={product_name}&json=true"
+        response = http.get(
+            "openfoodfacts",
+            FOOD_SEARCH_URL,
+            params={"action": "process", "search_terms": product_name, "json": "true"}
         )
-        response = requests.get(url)
         if response.status_code == 200:
             data = response.json()
             products = data.get('products', [])
@@ -43,58 +75,129 @@ def get_food_info(product_name: str) -> dict:
     except:
         return None
 
+def get_food_info(product_name: str) -> dict:
+    try:
+        info = food_db.lookup(product_name)
+    except Exception as e:
+        logger.warning("Local food DB lookup failed: %s", e)
+        info = None
+    if info:
+        return info
+    info = _search_food_remote(product_name)
+    if info:
+        try:
+            food_db.add(info['name'], info['calories'], aliases=[product_name])
+        except Exception as e:
+            logger.warning("Could not store %r in food DB: %s", product_name, e)
+    return info
+
+_food_pool = None
+_food_pool_lock = threading.Lock()
+
+def _food_executor():
+    global _food_pool
+    if _food_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with _food_pool_lock:
+            if _food_pool is None:
+                _food_pool = ThreadPoolExecutor(FOOD_LOOKUP_WORKERS, thread_name_prefix="food")
+    return _food_pool
+
+def get_food_infos(product_names: list, deadline: float = FOOD_LOOKUP_DEADLINE) -> dict:
+    from concurrent.futures import wait
+
+    unique = list(dict.fromkeys(product_names))
+    futures = {name: _food_executor().submit(get_food_info, name) for name in unique}
+    wait(futures.values(), timeout=deadline)
+    results = {}
+    for name, future in futures.items():
+        if future.done() and future.exception() is None:
+            results[name] = future.result()
+        else:
+            future.cancel()
+            results[name] = None
+    return results
+
+_FOOD_ITEM = re.compile(r"^(.*?\S)\s+(\d+(?:[.,]\d+)?)\s*(?:г|гр|g)?\.?$", re.IGNORECASE)
+
+def parse_food_items(text: str) -> list:
+    items = []
+    for part in re.split(r",(?!\d)", text):
+        part = part.strip()
+        if not part:
+            continue
+        m = _FOOD_ITEM.match(part)
+        if m:
+            items.append((m.group(1).strip(), float(m.group(2).replace(",", "."))))
+        else:
+            items.append((part, None))
+    return items
+
+# Shared by the per-user formulas and their vectorized versions in the recompute job.
+WATER_ML_PER_KG = 30.0
+WATER_ML_PER_ACTIVITY_STEP = 500
+ACTIVITY_STEP_MIN = 30
+WATER_CAP_ML = 2500
+BMR_OFFSET = {"male": 5, "female": -161}
+ACTIVITY_CALORIES = ((90, 400), (30, 200))  # (at least this many minutes a day, extra kcal)
+
+def _water_base(weight_kg, activity_min):
+    return weight_kg * WATER_ML_PER_KG + (activity_min // ACTIVITY_STEP_MIN) * WATER_ML_PER_ACTIVITY_STEP
+
+def _heat_extra(temperature: float) -> int:
+    if temperature >= 30:
+        return 1000
+    if temperature > 25:
+        return 500
+    return 0
+
+def _bmr(weight_kg, height_cm, age):
+    return 10*weight_kg + 6.25*height_cm - 5*age
+
+def _activity_extra(activity_min: float) -> int:
+    for minutes, extra in ACTIVITY_CALORIES:
+        if activity_min >= minutes:
+            return extra
+    return 0
+
 def calculate_water_goal_advanced(weight_kg: float, activity_min: float, temperature: float) -> float:
-    base = weight_kg * 30.0
-    extra_activity = (activity_min // 30) * 500
-    extra_temp = 0
-    if 25 < temperature < 30:
-        extra_temp = 500
-    elif temperature >= 30:
-        extra_temp = 1000
-    total = base + extra_activity + extra_temp
-    if total > 2500:
-        total = 2500
-    return total
+    return min(_water_base(weight_kg, activity_min) + _heat_extra(temperature), WATER_CAP_ML)
 
 def calculate_calorie_goal_advanced(weight_kg: float, height_cm: float, age: float,
                                     activity_min: float, gender: str="male") -> float:
-    if gender.lower() == 'male':
-        base_bmr = 10*weight_kg + 6.25*height_cm - 5*age + 5
-    else:
-        base_bmr = 10*weight_kg + 6.25*height_cm - 5*age - 161
-    add = 0
-    if 30 <= activity_min < 90:
-        add = 200
-    elif activity_min >= 90:
-        add = 400
-    return base_bmr + add
-
-def check_and_reset_day(user_data: dict):
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    if user_data.get("current_date") != today_str:
-        user_data["current_date"] = today_str
-        user_data["logged_water"] = 0
-        user_data["logged_calories"] = 0
-        user_data["burned_calories"] = 0
+    offset = BMR_OFFSET["male"] if gender.lower() == 'male' else BMR_OFFSET["female"]
+    return _bmr(weight_kg, height_cm, age) + offset + _activity_extra(activity_min)
+
+def calculate_water_goals(weight_kg, activity_min, temperature: float):
+    import numpy as np
+
+    return np.minimum(_water_base(weight_kg, activity_min) + _heat_extra(temperature), WATER_CAP_ML)
+
+def calculate_calorie_goals(weight_kg, height_cm, age, activity_min, is_male):
+    import numpy as np
+
+    offset = np.where(is_male, BMR_OFFSET["male"], BMR_OFFSET["female"])
+    add = np.select(
+        [activity_min >= minutes for minutes, _ in ACTIVITY_CALORIES],
+        [extra for _, extra in ACTIVITY_CALORIES],
+        0
+    )
+    return _bmr(weight_kg, height_cm, age) + offset + add
+
+def check_and_reset_day(user_data: UserState):
+    # Only move forward: a day key ahead of today (e.g. after a DST shift) keeps its counters.
+    today = clock.today(user_data.tz_offset)
+    if today > user_data.current_date:
+        user_data.reset_counters(today)
+
+def prewarm():
+    start = time.perf_counter()
+    http.warm(OPENWEATHER_URL, FOOD_SEARCH_URL)
+    food_db.load()
+    renderer.warm()
+    recommender.warm()
+    logger.info("Pre-warm finished in %.2f s", time.perf_counter() - start)
 
 def generate_progress_plot(w_logged, w_goal, c_logged, c_goal, c_burned) -> io.BytesIO:
-    fig, axes = plt.subplots(1, 2, figsize=(8, 4))
-    axes[0].bar(["Выпито"], [w_logged], color="blue", label="Выпито")
-    if w_goal > w_logged:
-        axes[0].bar(["Выпито"], [w_goal - w_logged], bottom=[w_logged], color="lightblue", label="Осталось")
-    axes[0].set_ylim([0, max(w_goal, w_logged)*1.1])
-    axes[0].set_title("Вода (мл)")
-    axes[0].legend()
-    axes[1].bar(["Калории"], [c_logged], color="red", label="Съедено")
-    axes[1].bar(["Калории"], [c_burned], bottom=[c_logged], color="green", label="Сожжено")
-    axes[1].axhline(y=c_goal, color="black", linestyle="--", label="Цель")
-    m = max(c_goal, c_logged + c_burned)
-    axes[1].set_ylim([0, m*1.1])
-    axes[1].set_title("Калории (ккал)")
-    axes[1].legend()
-    fig.tight_layout()
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close(fig)
-    return buf
+    return io.BytesIO(renderer.render_progress(w_logged, w_goal, c_logged, c_goal, c_burned))